@@ -0,0 +1,81 @@
+#######################
+# Forecast backtest
+#
+# Rolling-origin backtest of pollen_forecast: for every observed origin day
+# after --warmup days of history, the model is fitted on the rows up to that
+# day only and forecasts the next FORECAST_DAYS days, which are scored
+# against the readings. The error is the mean absolute error of log1p(num)
+# over every city and horizon with a reading, for each ridge penalty and for
+# persistence ("tomorrow equals today"), the baseline the ridge shrinks to.
+#
+#   python benchmarks/backtest_forecast.py [--ridges 1 10 100 1000 10000] [--warmup 30]
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+
+from pollen_forecast import FORECAST_DAYS, RIDGE, ForecastModel, forecast, statistics
+from pollen_store import load_pollen_store
+
+RIDGES = (1.0, 10.0, 100.0, 1000.0, 10000.0)
+WARMUP_DAYS = 30
+
+
+def row_statistics(store):
+    # Per-row X'X, X'y and counts, so the fit up to any origin is a cumulative sum
+    n = len(store.matrix)
+    parts = [statistics(store, row, row + 1) for row in range(1, n)]
+    xtx = np.cumsum([p[0] for p in parts], axis=0)
+    xty = np.cumsum([p[1] for p in parts], axis=0)
+    rows = np.cumsum([p[2] for p in parts], axis=0)
+    # Index by the last target row the fit includes
+    return {row: (xtx[row - 1], xty[row - 1], rows[row - 1]) for row in range(1, n)}
+
+
+def backtest(store, ridges=RIDGES, warmup=WARMUP_DAYS, n_days=FORECAST_DAYS):
+    """{name: (log-MAE, scored points)} for each ridge penalty and persistence."""
+    y = np.log1p(np.clip(store.matrix, 0, None))
+    cumulative = row_statistics(store)
+    origins = [row for row in np.flatnonzero(store.observed) if warmup <= row < len(y) - 1]
+    errors = {name: [] for name in [*('ridge %g' % r for r in ridges), 'persistence']}
+    for origin in origins:
+        actual = y[origin + 1:origin + 1 + n_days]
+        xtx, xty, rows = cumulative[origin]
+        for ridge in ridges:
+            model = ForecastModel(store.cities, store.first_day, origin + 1, xtx, xty, rows, None,
+                                  ridge=ridge).solve()
+            _, values = forecast(model, store, n_days, origin=store.days[origin])
+            errors['ridge %g' % ridge].append(np.abs(np.log1p(values[:len(actual)]) - actual))
+        # Persistence: forecast() with every coefficient zero keeps the level
+        zero = ForecastModel(store.cities, store.first_day, origin + 1, xtx, xty, rows,
+                             np.zeros_like(xty))
+        _, values = forecast(zero, store, n_days, origin=store.days[origin])
+        errors['persistence'].append(np.abs(np.log1p(values[:len(actual)]) - actual))
+    results = {}
+    for name, chunks in errors.items():
+        flat = np.concatenate([chunk.ravel() for chunk in chunks]) if chunks else np.empty(0)
+        flat = flat[~np.isnan(flat)]
+        results[name] = (float(flat.mean()) if len(flat) else float('nan'), len(flat))
+    return results, len(origins)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rolling-origin backtest of the pollen forecast.')
+    parser.add_argument('--ridges', type=float, nargs='+', default=list(RIDGES))
+    parser.add_argument('--warmup', type=int, default=WARMUP_DAYS, help='days of history before the first origin')
+    args = parser.parse_args(argv)
+
+    store = load_pollen_store()
+    results, n_origins = backtest(store, args.ridges, args.warmup)
+    print('%d origins, %d-day horizon, log1p MAE (current RIDGE = %g)' % (n_origins, FORECAST_DAYS, RIDGE))
+    for name, (mae, n) in results.items():
+        print('  %-14s %.4f  (%d points)' % (name, mae, n))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#######################
+# Dashboard benchmarks
+#
+# Generates synthetic pollen data at multiples of the real 4,370-row dataset
+# (more cities and more years), longer AQI/weather series, and times the
+# dashboard's data and render functions headlessly with the Agg backend:
+# CSV/snapshot loading, day slicing, the aggregate table and every make_*
+# chart builder (figure build plus PNG encoding, since Agg draws lazily).
+#
+# Timings are the minimum and median of --repeat runs; memory is the
+# tracemalloc peak of one extra run. Results are written as JSON together with
+# the git commit, so runs on two commits can be compared:
+#
+#   python benchmarks/bench_pollen.py --out base.json
+#   python benchmarks/bench_pollen.py --compare base.json
+#   python benchmarks/bench_pollen.py --scales 10 --only make_
+import argparse
+import json
+import math
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Shapefile, font and data paths in the modules are relative to the repo root
+os.chdir(ROOT)
+
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import pandas as pd
+
+BASE_ROWS = 4370
+BASE_CITIES = 36
+BASE_AQI_HOURS = 25
+BASE_WEATHER_DAYS = 15
+SCALES = (10, 100, 1000)
+SEED = 20240201
+
+
+#######################
+# Synthetic data
+def synthetic_cities(n):
+    # Real ADM2 names first so the map has regions to colour, then filler
+    from pollen_join import resolve_city_names
+    from pollen_loader import read_china_map
+
+    names = list(dict.fromkeys(resolve_city_names(read_china_map()).dropna()))
+    names += ['City%04d' % i for i in range(max(n - len(names), 0))]
+    return names[:n]
+
+
+def synthetic_pollen(scale, rng):
+    n_cities = max(BASE_CITIES, round(BASE_CITIES * math.sqrt(scale)))
+    n_days = math.ceil(BASE_ROWS * scale / n_cities)
+    days = pd.date_range('2015-01-01', periods=n_days, freq='D')
+    cities = synthetic_cities(n_cities)
+
+    # Spring/autumn peaks with log-normal noise, a few readings missing
+    season = np.sin(2 * np.pi * (days.dayofyear.to_numpy() - 60) / 365) ** 8
+    num = 50 + 2500 * season[:, None] * rng.lognormal(0, 0.6, (n_days, n_cities))
+    keep = rng.random((n_days, n_cities)) > 0.03
+    rows, codes = np.nonzero(keep)
+    return pd.DataFrame({
+        'Date': days[rows].strftime('%Y-%m-%d'),
+        'City': np.asarray(cities, dtype=object)[codes],
+        'num': np.round(num[rows, codes]),
+    })
+
+
+def write_panels(data_dir, scale, rng):
+    n_cities = 2 * max(1, round(scale ** (1 / 3)))
+    hours = BASE_AQI_HOURS * scale
+    n_days = BASE_WEATHER_DAYS * scale
+    for i in range(n_cities):
+        city = 'city%02d' % i
+        time_index = pd.date_range('2020-01-01', periods=hours, freq='h', tz='Asia/Shanghai')
+        pd.DataFrame({
+            'time': [t.isoformat(sep=' ') for t in time_index],
+            city + '_t': np.round(15 + 10 * rng.standard_normal(hours), 1),
+            city + '_a': np.round(rng.gamma(2, 30, hours)),
+        }).to_csv(os.path.join(data_dir, 'aqi_%s.csv' % city))
+        day_index = pd.date_range('2020-01-01 08:00', periods=n_days, freq='D', tz='Asia/Shanghai')
+        low = np.round(10 + 8 * rng.standard_normal(n_days))
+        pd.DataFrame({
+            '日期': [t.isoformat(sep=' ') for t in day_index],
+            '天气': rng.choice(['晴', '多云', '阴', '小雨'], n_days),
+            '最低气温': low,
+            '最高气温': low + np.round(rng.uniform(3, 12, n_days)),
+        }).to_csv(os.path.join(data_dir, 'weather_%s.csv' % city), index=False)
+
+
+def make_dataset(scale, workdir):
+    rng = np.random.default_rng(SEED + scale)
+    data_dir = os.path.join(workdir, 'x%d' % scale)
+    os.makedirs(data_dir, exist_ok=True)
+    csv_path = os.path.join(data_dir, 'pollen.csv')
+    synthetic_pollen(scale, rng).to_csv(csv_path, index=False)
+    write_panels(data_dir, scale, rng)
+    return data_dir, csv_path
+
+
+#######################
+# Cases
+def bench_cases(data_dir, csv_path):
+    """[(name, setup)] where setup() prepares inputs and returns the callable to time."""
+    from pollen_aggregates import build_aggregates
+    from pollen_charts import MAP_FIGSIZE, make_bar, make_chart, make_full_aqi_charts, make_full_weather_charts, make_pollen_map
+    from pollen_geometry import prepare_geometry
+    from pollen_loader import clear_cache, read_china_map, read_pollen_csv
+    from pollen_panels import discover, read_panel
+    from pollen_render_cache import RENDER_DPI, figure_to_png
+    from pollen_snapshot import compile_snapshot, load_snapshot
+    from pollen_store import PollenStore
+
+    snapshot_dir = os.path.join(data_dir, 'snapshot')
+    compile_snapshot(csv_path, snapshot_dir)
+    store = PollenStore.from_snapshot(load_snapshot(snapshot_dir))
+    day = store.day_list()[len(store.day_list()) // 2]
+    aggregates = build_aggregates(store)
+    geo = prepare_geometry(read_china_map(), store.cities, MAP_FIGSIZE, RENDER_DPI)
+    aqi_panel = read_panel('aqi', discover('aqi', data_dir))
+    weather_panel = read_panel('weather', discover('weather', data_dir))
+    many = list(store.cities[:24])
+
+    def render(builder, *args):
+        return lambda: figure_to_png(builder(*args))
+
+    return [
+        ('load:read_csv', lambda: lambda: read_pollen_csv(csv_path)),
+        ('load:compile_snapshot', lambda: lambda: compile_snapshot(csv_path, snapshot_dir)),
+        ('load:store_from_snapshot', lambda: lambda: PollenStore.from_snapshot(load_snapshot(snapshot_dir))),
+        ('load:store_from_csv', lambda: lambda: PollenStore.from_frame(read_pollen_csv(csv_path))),
+        ('load:aqi_panel', lambda: lambda: read_panel('aqi', discover('aqi', data_dir))),
+        ('load:weather_panel', lambda: lambda: read_panel('weather', discover('weather', data_dir))),
+        ('slice:day', lambda: lambda: store.day(day)),
+        ('slice:day_frame', lambda: lambda: store.day_frame(day)),
+        ('slice:window_10', lambda: lambda: store.window(day, 10)),
+        ('slice:series_2', lambda: lambda: store.series(many[:2])),
+        ('aggregates:build', lambda: lambda: build_aggregates(store)),
+        ('aggregates:top', lambda: lambda: aggregates.top(day)),
+        ('make_pollen_map', lambda: render(make_pollen_map, store.day_frame(day), geo, day)),
+        ('make_chart:2', lambda: render(make_chart, store, many[:2])),
+        ('make_chart:24', lambda: render(make_chart, store, many)),
+        ('make_bar', lambda: render(make_bar, *aggregates.top(day), '花粉最多十城市', 5, 5)),
+        ('make_aqi_charts', lambda: render(make_full_aqi_charts, aqi_panel)),
+        ('make_weather_charts', lambda: render(make_full_weather_charts, weather_panel)),
+    ], clear_cache
+
+
+def run_case(func, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'min_s': min(times), 'median_s': float(np.median(times)), 'peak_bytes': peak}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=ROOT).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'matplotlib': matplotlib.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def run(scales, repeat, only=None, workdir=None):
+    results = {'environment': environment(), 'repeat': repeat, 'cases': []}
+    workdir = workdir or tempfile.mkdtemp(prefix='pollen_bench_')
+    try:
+        for scale in scales:
+            t0 = time.perf_counter()
+            data_dir, csv_path = make_dataset(scale, workdir)
+            cases, clear_cache = bench_cases(data_dir, csv_path)
+            print('x%d: %d rows, data ready in %.1fs' % (scale, BASE_ROWS * scale, time.perf_counter() - t0),
+                  file=sys.stderr)
+            for name, setup in cases:
+                if only and not re.search(only, name):
+                    continue
+                clear_cache()
+                result = {'scale': scale, 'case': name, **run_case(setup(), repeat)}
+                results['cases'].append(result)
+                print('  %-28s %9.1f ms  %8.1f MiB' % (name, result['min_s'] * 1000,
+                                                      result['peak_bytes'] / 2 ** 20), file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    old = {(c['scale'], c['case']): c for c in baseline['cases']}
+    print('%-6s %-28s %10s %10s %7s %9s' % ('scale', 'case', 'base ms', 'ms', 'ratio', 'mem'))
+    for case in results['cases']:
+        base = old.get((case['scale'], case['case']))
+        if base is None:
+            continue
+        ratio = case['min_s'] / base['min_s'] if base['min_s'] else float('nan')
+        mem = case['peak_bytes'] / base['peak_bytes'] if base['peak_bytes'] else float('nan')
+        flag = '  <-- slower' if ratio > 1.2 else ''
+        print('x%-5d %-28s %10.1f %10.1f %6.2fx %8.2fx%s' % (
+            case['scale'], case['case'], base['min_s'] * 1000, case['min_s'] * 1000, ratio, mem, flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pollen dashboard on synthetic data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES),
+                        help='multiples of the real dataset (default: 10 100 1000)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help='regex selecting case names')
+    parser.add_argument('--out', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON from an earlier run')
+    args = parser.parse_args(argv)
+
+    results = run(args.scales, args.repeat, args.only)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#######################
+# Cold start report
+#
+# Runs the dashboard's module-level imports in a fresh interpreter under
+# `python -X importtime` and summarizes where the import time goes, by
+# top-level package. With --first-run it also times a complete first script
+# run in a fresh process (streamlit's AppTest, no browser), which adds the
+# data loading and the first renders on top of the imports.
+#
+#   python benchmarks/bench_startup.py [--top 15] [--first-run] [--json OUT]
+import argparse
+import ast
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, 'pollen_web.py')
+IMPORTTIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+# Imported by the app only on the paths that need them
+DEFERRED = ('altair', 'pollen_vector', 'pollen_playback', 'pollen_spatial')
+
+
+def app_imports(path=APP):
+    """Modules imported at the top level of the script, in order."""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def import_times(modules):
+    """(wall seconds, [(module, depth, self us, cumulative us)]) for a cold import."""
+    code = 'import ' + ', '.join(modules)
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((name, len(indent) // 2, int(self_us), int(cumulative_us)))
+    return wall, rows
+
+
+def first_run_seconds():
+    code = ('import time; from streamlit.testing.v1 import AppTest; t = time.perf_counter(); '
+            'at = AppTest.from_file(%r, default_timeout=600); at.run(); '
+            'assert not at.exception, [e.value for e in at.exception]; '
+            'print(time.perf_counter() - t)' % APP)
+    proc = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the cold start cost of pollen_web.py.')
+    parser.add_argument('--top', type=int, default=15, help='packages to list')
+    parser.add_argument('--first-run', action='store_true', help='also time a full first script run')
+    parser.add_argument('--json', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    modules = app_imports()
+    wall, rows = import_times(modules)
+    loaded = {name for name, _, _, _ in rows}
+    packages = {}
+    for name, depth, self_us, _ in rows:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+
+    print('imports of %s: %s' % (os.path.basename(APP), ', '.join(modules)))
+    print('interpreter + imports: %.0f ms wall, %.0f ms in imports'
+          % (wall * 1000, sum(row[2] for row in rows) / 1000))
+    print('%-28s %10s' % ('package (self time, all submodules)', 'ms'))
+    for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print('  %-26s %10.1f' % (package, self_us / 1000))
+    deferred = [name for name in DEFERRED if name in loaded]
+    print('deferred modules loaded at startup: %s' % (', '.join(deferred) or 'none'))
+
+    report = {'modules': modules, 'wall_s': wall, 'packages_us': packages, 'deferred_loaded': deferred}
+    if args.first_run:
+        report['first_run_s'] = first_run_seconds()
+        print('first script run: %.2f s' % report['first_run_s'])
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
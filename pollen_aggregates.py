@@ -0,0 +1,168 @@
+#######################
+# Materialized pollen aggregates
+#
+# Per-day top-K cities, per-day counts of cities in each risk tier and
+# per-city rolling 7/30-day means, computed for the whole store at once and
+# refreshed incrementally for the days touched by ingestion. The tables are
+# stored with the snapshot, so server processes read them instead of
+# rebuilding, and the dashboard reads a row instead of sorting a day per rerun.
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from pollen_loader import memo, prime_memo
+from pollen_snapshot import load_derived, save_derived
+
+TOP_K = 10
+ROLLING_WINDOWS = (7, 30)
+# Upper bounds of the tiers in the 花粉指数 legend, inclusive
+RISK_BINS = [50, 100, 300, 500, 800]
+RISK_LEVELS = ['很低', '较低', '偏高', '较高', '很高', '极高']
+
+
+def risk_tiers(values):
+    # 0 for <=50 ... 5 for >=801
+    return np.digitize(values, RISK_BINS, right=True)
+
+
+def top_k(matrix, k):
+    """(codes, values) of the k largest values per row, descending; -1/NaN pad."""
+    k = min(k, matrix.shape[1])
+    filled = np.where(np.isnan(matrix), -np.inf, matrix)
+    # Partial sort: only the k winners of each row get ordered
+    part = np.argpartition(-filled, k - 1, axis=1)[:, :k] if k else np.empty((len(matrix), 0), np.int64)
+    order = np.argsort(-np.take_along_axis(filled, part, axis=1), axis=1, kind='stable')
+    codes = np.take_along_axis(part, order, axis=1)
+    values = np.take_along_axis(matrix, codes, axis=1)
+    codes = np.where(np.isnan(values), -1, codes).astype(np.int16)
+    return codes, values
+
+
+def tier_counts(matrix):
+    tiers = risk_tiers(matrix)
+    valid = ~np.isnan(matrix)
+    rows = np.broadcast_to(np.arange(len(matrix))[:, None], matrix.shape)
+    flat = rows[valid] * len(RISK_LEVELS) + tiers[valid]
+    counts = np.bincount(flat, minlength=len(matrix) * len(RISK_LEVELS))
+    return counts.reshape(len(matrix), len(RISK_LEVELS)).astype(np.int32)
+
+
+def rolling_means(matrix, window):
+    # NaN-aware trailing mean over `window` days, vectorized per column
+    return pd.DataFrame(matrix).rolling(window, min_periods=1).mean().to_numpy(np.float32)
+
+
+@dataclass
+class PollenAggregates():
+    first_day: np.datetime64
+    cities: pd.Index
+    top_codes: np.ndarray     # (days, K) city codes, -1 where fewer cities
+    top_values: np.ndarray    # (days, K)
+    tiers: np.ndarray         # (days, len(RISK_LEVELS)) city counts
+    rolling: dict             # window -> (days, cities) trailing means
+    version: object = None
+
+    @classmethod
+    def from_arrays(cls, arrays, version):
+        rolling = {int(key[len('rolling'):]): arrays[key] for key in arrays if key.startswith('rolling')}
+        return cls(arrays['first_day'][()], pd.Index(arrays['cities']), arrays['top_codes'],
+                   arrays['top_values'], arrays['tiers'], rolling, version)
+
+    def to_arrays(self):
+        arrays = {'first_day': np.asarray(self.first_day), 'cities': np.asarray(self.cities, dtype=str),
+                  'top_codes': self.top_codes, 'top_values': self.top_values, 'tiers': self.tiers}
+        arrays.update({'rolling%d' % w: mean for w, mean in self.rolling.items()})
+        return arrays
+
+    def row(self, day):
+        offset = int((np.datetime64(day, 'D') - self.first_day).astype(np.int64))
+        if not 0 <= offset < len(self.tiers):
+            raise KeyError(day)
+        return offset
+
+    def top(self, day, k=TOP_K):
+        row = self.row(day)
+        codes = self.top_codes[row, :k]
+        codes = codes[codes >= 0]
+        return self.cities[codes], self.top_values[row, :len(codes)]
+
+    def tier_summary(self, day):
+        return pd.DataFrame({'等级': RISK_LEVELS, '城市数': self.tiers[self.row(day)]})
+
+    def rolling_mean(self, day, window):
+        return self.rolling[window][self.row(day)]
+
+
+def build_aggregates(store, k=TOP_K, windows=ROLLING_WINDOWS):
+    codes, values = top_k(store.matrix, k)
+    return PollenAggregates(store.first_day, store.cities, codes, values, tier_counts(store.matrix),
+                            {w: rolling_means(store.matrix, w) for w in windows}, store.version)
+
+
+def refresh_aggregates(aggregates, store, days):
+    """Recompute only the rows affected by `days`; rebuild if the layout changed."""
+    if (aggregates.first_day != store.first_day or not aggregates.cities.equals(store.cities)
+            or len(days) == 0):
+        # top_k() clips K to the city count, so a narrower table is not a smaller K
+        return build_aggregates(store, max(aggregates.top_codes.shape[1], TOP_K), tuple(aggregates.rolling))
+    n, old_len = len(store.matrix), len(aggregates.tiers)
+    grow = n - old_len
+    if grow > 0:
+        pad = lambda a, fill: np.concatenate((a, np.full((grow,) + a.shape[1:], fill, a.dtype)))
+        aggregates.top_codes = pad(aggregates.top_codes, -1)
+        aggregates.top_values = pad(aggregates.top_values, np.nan)
+        aggregates.tiers = pad(aggregates.tiers, 0)
+        aggregates.rolling = {w: pad(mean, np.nan) for w, mean in aggregates.rolling.items()}
+
+    rows = np.unique([store.row(day) for day in days])
+    codes, values = top_k(store.matrix[rows], aggregates.top_codes.shape[1])
+    aggregates.top_codes[rows], aggregates.top_values[rows] = codes, values
+    aggregates.tiers[rows] = tier_counts(store.matrix[rows])
+    # A changed day moves the trailing windows of the following w - 1 days;
+    # padded gap rows before an appended day still need their trailing means
+    lo, hi = rows.min(), rows.max()
+    if grow > 0:
+        lo = min(lo, old_len)
+    for w, mean in aggregates.rolling.items():
+        start = max(lo - w + 1, 0)
+        stop = min(hi + w, n)
+        mean[lo:stop] = rolling_means(store.matrix[start:stop], w)[lo - start:]
+    aggregates.version = store.version
+    return aggregates
+
+
+def read_aggregates(store, version):
+    # The table stored with the store's snapshot for data `version`, or None
+    if store.snapshot_dir is None:
+        return None
+    arrays = load_derived('aggregates', version, store.snapshot_dir)
+    return None if arrays is None else PollenAggregates.from_arrays(arrays, version)
+
+
+def save_aggregates(aggregates, store):
+    if store.snapshot_dir is not None:
+        save_derived('aggregates', aggregates.version, aggregates.to_arrays(), store.snapshot_dir)
+
+
+def load_aggregates(store):
+    # One table per data version, shared by every session; normally read
+    # from the snapshot, built (and stored) only when it is missing there
+    def build():
+        aggregates = read_aggregates(store, store.version)
+        if aggregates is None:
+            aggregates = build_aggregates(store)
+            save_aggregates(aggregates, store)
+        return aggregates
+
+    return memo('aggregates', store.version, build)
+
+
+def update_aggregates(store, days, previous_version):
+    # Incremental from the table stored for the data as it was before `days`
+    # changed; a full build when there is none.
+    previous = read_aggregates(store, previous_version)
+    aggregates = build_aggregates(store) if previous is None else refresh_aggregates(previous, store, days)
+    save_aggregates(aggregates, store)
+    prime_memo('aggregates', store.version, aggregates)
+    return aggregates
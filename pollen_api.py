@@ -0,0 +1,394 @@
+#######################
+# Headless HTTP API
+#
+# A plain ASGI application over the same store, aggregates, image store and
+# chart builders as the dashboard, for clients that need the numbers or the
+# daily images without Streamlit:
+#
+#   GET /days                           observed days, newest first
+#   GET /pollen?city=Chengde&date=D     one city on one day (+ rolling means)
+#   GET /top?date=D&k=10                the day's top cities
+#   GET /region?x=116.4&y=39.9&date=D   the city at a map coordinate (+ history)
+#   GET /forecast?city=Chengde          next days after the latest (all cities without city)
+#   GET /map.png?date=D, /bar.png?date=D
+#
+# `date` defaults to the latest observed day. Responses carry an ETag and
+# honour If-None-Match (images are fingerprinted by the day's values, so a
+# 304 needs no rendering); JSON is gzipped when the client accepts it.
+# Images that are neither pre-rendered nor cached are drawn in a bounded
+# process pool, keeping matplotlib off the event loop. The data structures
+# are loaded at startup and re-checked in a thread, so a reload after an
+# ingest does not block other requests either.
+#
+# Usage: python pollen_api.py [--host 127.0.0.1] [--port 8000]   (needs uvicorn)
+#        python pollen_api.py --get '/top?k=5'                    (in-process, no server)
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from datetime import date
+from urllib.parse import parse_qs
+
+import numpy as np
+
+from pollen_aggregates import TOP_K, load_aggregates
+from pollen_store import load_pollen_store
+
+RENDER_WORKERS = 2
+# Renders allowed to wait for a worker before requests get 503
+MAX_PENDING_RENDERS = 16
+GZIP_MIN_BYTES = 512
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Response():
+    status: int = 200
+    body: bytes = b''
+    content_type: str = 'application/json'
+    etag: str = None
+    headers: list = field(default_factory=list)
+
+
+def json_response(data):
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return Response(body=body, etag='"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest())
+
+
+def number(value):
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+async def off_loop(func, *args):
+    # Loaders stat their files and may rebuild; run them in a thread
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def warm():
+    # Everything the routes load, built (or read from disk) before serving
+    from pollen_forecast import load_forecast
+    from pollen_prerender import load_map_geometry
+    from pollen_spatial import load_region_index
+
+    store = load_pollen_store()
+    load_aggregates(store)
+    load_forecast(store)
+    load_region_index(load_map_geometry(store))
+
+
+#######################
+# Query helpers
+def query_day(store, query):
+    if 'date' not in query:
+        return store.days[np.flatnonzero(store.observed)[-1]].item()
+    try:
+        day = date.fromisoformat(query['date'])
+    except ValueError:
+        raise ApiError(400, 'date must be YYYY-MM-DD')
+    if day not in store or not store.observed[store.row(day)]:
+        raise ApiError(404, 'no data for %s' % day)
+    return day
+
+
+def query_int(query, name, default, lo, hi):
+    try:
+        value = int(query.get(name, default))
+    except ValueError:
+        raise ApiError(400, '%s must be an integer' % name)
+    return min(max(value, lo), hi)
+
+
+#######################
+# Routes
+async def get_days(request):
+    store = await off_loop(load_pollen_store)
+    return json_response([str(day) for day in store.day_list()])
+
+
+async def get_pollen(request):
+    store = await off_loop(load_pollen_store)
+    city = request.query.get('city')
+    if city is None:
+        raise ApiError(400, 'city is required')
+    if city not in store.cities:
+        raise ApiError(404, 'unknown city %r' % city)
+    day = query_day(store, request.query)
+    code = store.cities.get_loc(city)
+    aggregates = await off_loop(load_aggregates, store)
+    return json_response({
+        'city': city,
+        'date': str(day),
+        'num': number(store.day(day)[code]),
+        'mean7': number(aggregates.rolling_mean(day, 7)[code]),
+        'mean30': number(aggregates.rolling_mean(day, 30)[code]),
+    })
+
+
+async def get_top(request):
+    store = await off_loop(load_pollen_store)
+    day = query_day(store, request.query)
+    k = query_int(request.query, 'k', TOP_K, 1, TOP_K)
+    cities, values = (await off_loop(load_aggregates, store)).top(day, k)
+    return json_response({
+        'date': str(day),
+        'top': [{'city': city, 'num': number(value)} for city, value in zip(cities, values)],
+    })
+
+
+async def get_forecast(request):
+    from pollen_forecast import forecast, load_forecast
+
+    store = await off_loop(load_pollen_store)
+    days, values = forecast(await off_loop(load_forecast, store), store)
+    city = request.query.get('city')
+    if city is not None and city not in store.cities:
+        raise ApiError(404, 'unknown city %r' % city)
+    cities = [city] if city is not None else list(store.cities)
+    return json_response({
+        'days': [str(day) for day in days],
+        'forecast': {c: [number(v) for v in values[:, store.cities.get_loc(c)]] for c in cities},
+    })
+
+
+async def get_region(request):
+    from pollen_prerender import load_map_geometry
+    from pollen_spatial import city_at
+
+    store = await off_loop(load_pollen_store)
+    try:
+        x, y = float(request.query['x']), float(request.query['y'])
+    except (KeyError, ValueError):
+        raise ApiError(400, 'x and y must be numbers')
+    day = query_day(store, request.query)
+    geo = await off_loop(load_map_geometry, store)
+    # The region index (an STRtree) is built on first use
+    info = await off_loop(city_at, store, geo, x, y, day)
+    if info is None:
+        raise ApiError(404, 'no pollen city at %s, %s' % (x, y))
+    return json_response({
+        'city': info.city,
+        'name': info.name,
+        'date': str(day),
+        'num': number(info.num),
+        'history': [{'date': str(d), 'num': number(v)}
+                    for d, v in zip(info.history_days.astype('datetime64[D]'), info.history)],
+    })
+
+
+def _render_day_png(kind, day):
+    # Runs in a worker process; the loaders re-check the data files per call
+    import matplotlib
+    matplotlib.use('Agg')
+    from pollen_prerender import load_day_chart, load_map_geometry
+    from pollen_render_cache import figure_to_png
+
+    store = load_pollen_store()
+    chart = load_day_chart(kind, store, load_map_geometry(store), day)
+    return chart if isinstance(chart, bytes) else figure_to_png(chart)
+
+
+class RenderPool():
+    """Process pool for matplotlib with a bounded queue in front of it."""
+
+    def __init__(self, workers=RENDER_WORKERS, max_pending=MAX_PENDING_RENDERS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = None
+        self._pending = 0
+
+    async def run(self, func, *args):
+        if self._pending >= self.max_pending:
+            raise ApiError(503, 'render queue full')
+        if self._pool is None:
+            # spawn: forking a threaded server process is not safe
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        pool = self._pool
+        self._pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); the next render starts a
+            # fresh pool, unless another request already replaced this one
+            if self._pool is pool:
+                self.shutdown(wait=False)
+            raise ApiError(503, 'render worker failed')
+        finally:
+            self._pending -= 1
+
+    def shutdown(self, wait=True):
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=True)
+            self._pool = None
+
+
+render_pool = RenderPool()
+
+
+def day_chart_route(kind):
+    async def get_chart(request):
+        from pollen_prerender import day_digest, image_store, load_map_geometry, render_version
+        from pollen_render_cache import figure_cache
+
+        store = await off_loop(load_pollen_store)
+        day = query_day(store, request.query)
+        geo = await off_loop(load_map_geometry, store)
+        digest, version = day_digest(store, day), render_version(geo)
+        etag = '"%s-%s"' % (digest, hashlib.blake2b(version.encode(), digest_size=6).hexdigest())
+        if request.matches(etag):
+            return Response(status=304, content_type='image/png', etag=etag)
+
+        # This process's image cache, then the pre-rendered image store
+        key = ('pollen_map' if kind == 'map' else kind, day, store.version)
+        png = figure_cache.get(key) or await off_loop(image_store.load, day, kind, digest, version)
+        if png is None:
+            png = await render_pool.run(_render_day_png, kind, day)
+        figure_cache.put(key, png)
+        return Response(body=png, content_type='image/png', etag=etag)
+    return get_chart
+
+
+ROUTES = {
+    '/days': get_days,
+    '/pollen': get_pollen,
+    '/top': get_top,
+    '/region': get_region,
+    '/forecast': get_forecast,
+    '/map.png': day_chart_route('map'),
+    '/bar.png': day_chart_route('bar'),
+}
+
+
+#######################
+# ASGI plumbing
+@dataclass
+class Request():
+    method: str
+    path: str
+    query: dict
+    headers: dict
+
+    @classmethod
+    def from_scope(cls, scope):
+        query = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        return cls(scope['method'], scope['path'], query, headers)
+
+    def matches(self, etag):
+        tags = [tag.strip() for tag in self.headers.get('if-none-match', '').split(',')]
+        return etag in tags or '*' in tags
+
+    def accepts_gzip(self):
+        return 'gzip' in self.headers.get('accept-encoding', '')
+
+
+async def handle(request):
+    if request.method not in ('GET', 'HEAD'):
+        raise ApiError(405, 'method not allowed')
+    route = ROUTES.get(request.path.rstrip('/') or '/')
+    if route is None:
+        raise ApiError(404, 'not found')
+    response = await route(request)
+    if response.status == 200 and response.etag and request.matches(response.etag):
+        return Response(status=304, content_type=response.content_type, etag=response.etag)
+    return response
+
+
+def encode(request, response):
+    headers = [(b'content-type', response.content_type.encode())] + response.headers
+    body = response.body
+    if response.etag:
+        headers.append((b'etag', response.etag.encode()))
+    if response.content_type == 'application/json':
+        headers.append((b'vary', b'accept-encoding'))
+        if len(body) >= GZIP_MIN_BYTES and request.accepts_gzip():
+            body = gzip.compress(body, compresslevel=5)
+            headers.append((b'content-encoding', b'gzip'))
+    headers.append((b'content-length', str(len(body)).encode()))
+    if request.method == 'HEAD' or response.status == 304:
+        body = b''
+    return headers, body
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await off_loop(warm)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                render_pool.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    request = Request.from_scope(scope)
+    try:
+        response = await handle(request)
+    except ApiError as e:
+        response = json_response({'error': str(e)})
+        response.status, response.etag = e.status, None
+    headers, body = encode(request, response)
+    await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def call(path, headers=None, method='GET'):
+    """Drive `app` in-process: (status, headers, body). For scripts and local checks."""
+    path, _, query_string = path.partition('?')
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query_string.encode(),
+        'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    response_headers = {k.decode(): v.decode() for k, v in sent[0]['headers']}
+    return sent[0]['status'], response_headers, sent[1]['body']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the pollen JSON/PNG API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=RENDER_WORKERS, help='render processes')
+    parser.add_argument('--get', metavar='PATH', help='answer one request in-process and exit')
+    args = parser.parse_args(argv)
+
+    render_pool.workers = args.workers
+    if args.get:
+        status, headers, body = asyncio.run(call(args.get))
+        render_pool.shutdown()
+        print(status, headers.get('content-type'), headers.get('etag'))
+        print(body.decode('utf-8') if headers.get('content-type') == 'application/json'
+              else '<%d bytes>' % len(body))
+        return
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,504 @@
+#######################
+# Chart builders
+#
+# Every make_* function returns a matplotlib figure and has no Streamlit
+# dependency, so the dashboard, the pre-render CLI and other tools share them.
+import os
+from dataclasses import dataclass
+
+import matplotlib as mpl
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+import numpy as np
+
+from pollen_downsample import lttb_indices, minmax_indices, pixel_budget
+from pollen_panels import city_name
+from pollen_trace import traced
+
+FONT_PATH = 'font/SimHei.ttf'
+MAP_FIGSIZE = (6, 4)
+
+# China font simhei added to show chinese characters
+if os.path.exists(FONT_PATH):
+    mpl.font_manager.fontManager.addfont(FONT_PATH) #临时注册新的全局字体
+plt.rcParams['font.sans-serif']=['SimHei'] #用来正常显示中文标签
+plt.rcParams['axes.unicode_minus']=False#用来正常显示负号
+
+######################
+# Global Value
+columnA = 'Beijing Municipality'
+columnB = 'Chengde'
+labelA = '北京'
+labelB = '承德'
+compare_colors = ['#00A88F', '#884b8f'] + [mpl.colors.to_hex(c) for c in plt.get_cmap('tab20').colors]
+compare_markers = ['o', '+', 'x', '^', 's', 'v', 'D', '*']
+panel_markers = ['o', 'x', '+', '^', 's', 'v', 'D', '*']
+# Above this many cities the lines go into one LineCollection without markers
+max_marked_lines = len(compare_markers)
+
+def make_city_labels(regions):
+    # Chinese display names from the ADM2 layer, e.g. 'Beijing Municipality' -> '北京'
+    return dict(zip(regions.City, regions.ADM2_ZH.str.replace(r'\[\d+\]$', '', regex=True).str.rstrip('市')))
+
+# Chart
+@traced()
+def make_chart(input_store, cities=(columnA, columnB), labels=None, start=None, end=None, forecast=None):
+    labels = labels or {columnA: labelA, columnB: labelB}
+    cities = list(cities)
+    line_days, pollen_line = input_store.series(cities, start, end)
+    ############################
+    # Init
+    fig, ax = plt.subplots(figsize=(12,8))
+    # ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
+    # ax.xaxis.set_minor_locator(mdates.DayLocator())
+    # ax.xaxis.set_major_formatter(DateFormatter("%m-%d"))
+    
+    locator = mdates.AutoDateLocator(minticks=11, maxticks=21)
+    formatter = mdates.ConciseDateFormatter(locator)
+    formatter.formats = ['%y',  # ticks are mostly years
+                         '%y-%m',       # ticks are mostly months
+                         '%d',       # ticks are mostly days
+                         '%H:%M',    # hrs
+                         '%H:%M',    # min
+                         '%S.%f', ]  # secs
+    # these are mostly just the level above...
+    formatter.zero_formats = [''] + formatter.formats[:-1]
+    # ...except for ticks that are mostly hours, then it is nice to have
+    # month-day:
+    formatter.zero_formats[3] = '%m-%d'
+
+    formatter.offset_formats = ['',
+                                '%Y',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d %H:%M', ]
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(formatter)
+      
+    ax.grid(True)
+    ax.grid(which='major', color='#DDDDDD', linewidth=0.9)
+    ax.grid(which='minor', color='#CCCCCC', linestyle=':', linewidth=0.8)
+    ax.minorticks_on()
+
+    # Set title
+    names = [labels.get(city, city) for city in cities]
+    if len(names) <= 4:
+        ax.set_title('花粉指数: ' + ' ：'.join(names))
+    else:
+        ax.set_title('花粉指数: %d 个城市' % len(names))
+    if len(line_days) == 0 or not cities:
+        return fig
+    # Set the limits for the Y axis, widened for cities above the usual range
+    ymax = max([2100] + [np.nanmax(pollen_line[city]) * 1.05 for city in cities
+                         if not np.isnan(pollen_line[city]).all()])
+    ax.set_ylim([-100, ymax])
+    # ax.set_xlim([0, 100])
+    # A forecast (days, values per store city) continues lines that reach its start
+    show_forecast = forecast is not None and line_days[-1] >= forecast[0][0] - np.timedelta64(1, 'D')
+    ax.set_xlim(line_days[0], forecast[0][-1] if show_forecast else line_days[-1])
+  
+    colors = [compare_colors[i % len(compare_colors)] for i in range(len(cities))]
+    # Multi-year ranges are reduced to about one point per pixel
+    budget = pixel_budget(ax)
+    x = mdates.date2num(line_days)
+    if len(cities) <= max_marked_lines:
+        for city, name, color, marker in zip(cities, names, colors, compare_markers):
+            idx = lttb_indices(x, pollen_line[city], budget)
+            marker = marker if len(line_days) <= budget else None
+            ax.plot(line_days[idx], pollen_line[city][idx], marker=marker, color=color, linestyle='dotted', label=name)
+        legend = ax.legend(loc='upper left', shadow=False, fontsize='medium')
+    else:
+        # One collection draws every city in a single call; NaN days break the lines
+        segments = []
+        for city in cities:
+            idx = minmax_indices(pollen_line[city], budget // 2)
+            segments.append(np.column_stack((x[idx], pollen_line[city][idx])))
+        ax.add_collection(LineCollection(segments, colors=colors, linewidths=0.8))
+        handles = [Line2D([], [], color=color, label=name) for color, name in zip(colors, names)]
+        legend = ax.legend(handles=handles, loc='upper left', shadow=False, fontsize='small',
+                           ncol=(len(cities) + 11) // 12)
+    legend.get_frame().set_facecolor('None')
+    if show_forecast:
+        forecast_days, forecast_values = forecast
+        fx = mdates.date2num(np.concatenate(([line_days[-1]], forecast_days)))
+        segments = [np.column_stack((fx, np.concatenate(([pollen_line[city][-1]],
+                                                          forecast_values[:, input_store.cities.get_loc(city)]))))
+                    for city in cities]
+        ax.add_collection(LineCollection(segments, colors=colors, linewidths=1.2, linestyles='dashed'))
+        ax.axvspan(fx[0], fx[-1], color='#EEEEEE', alpha=0.5, zorder=0)
+    return fig
+
+# Pollen Map
+@traced()
+def make_pollen_map(input_df, input_geo, input_date):
+    # Drawing map with matplotlib
+    fig, ax = plt.subplots(1, 
+                           figsize = input_geo.figsize)
+    fig.set_facecolor('none')
+    
+    # Filter data based on current date
+    current_data = input_df
+    
+    # Scatter the day's values onto the prepared regions
+    region_values = input_geo.join.scatter(current_data.City, current_data.num)
+    
+    # Parameters for missing values
+    missing_kwds = {
+        "color"    : "white",
+        "edgecolor": "lightgrey",
+        "hatch"    : "///", 
+        "label"    : "缺失值"
+    }
+    
+    classification_kwds = {
+        'bins': [50, 100, 300, 500, 800, 9999]
+        }
+
+    legend_kwds = {
+        'loc': 'lower right', 
+        'prop': {'size': 7 },
+        'title': '花粉过敏指数', 
+        "edgecolor": "grey",
+        'fontsize': '5',
+        'title_fontsize': '8',
+        'shadow': True
+        }
+    
+    # Create a custom colormap
+    # colors_list = color_breaks
+    # cmap_name   = "default_cmap"
+    # cmap        = (colors
+    #                .LinearSegmentedColormap
+    #                .from_list(cmap_name, colors_list))
+
+    # Provinces without pollen cities are drawn as missing values
+    input_geo.outline.plot(ax=ax, color='lightgrey', edgecolor='grey', linewidth=0.1, hatch='///')
+    input_geo.regions.plot(column=region_values, cmap='coolwarm', linewidth=0.1, ax=ax, edgecolor='grey',
+                      legend=False, vmin=0, vmax=3000, missing_kwds={'color': 'lightgrey', 'hatch': '///'})
+    # map_for_date.plot(ax=ax, 
+    #                   column='num',     
+    #                   edgecolor    = "grey",                         
+    #                 #   cmap         = cmap,
+    #                   cmap         = 'Reds',
+    #                   linewidth    = 0.5,
+    #                   legend       = True,
+    #                   missing_kwds = missing_kwds,
+    #                   scheme       = 'UserDefined',
+    #                   classification_kwds = classification_kwds,
+    #                   legend_kwds  = legend_kwds
+    #                  )
+    
+    # Label every region of a city in the input, as the inner merge did
+    labelled = input_geo.regions[input_geo.regions.City.isin(current_data.City)]
+    for x, y, region in zip(labelled.label_x, labelled.label_y, labelled.ADM2_ZH):
+        ax.text(x, y, region[:5], ha="center", va="center", size=4)
+    
+    #Title, lines and annotations
+    # ax.set_title('Tracking Pollen Index', fontsize=25, pad=30, weight='bold')
+    # ax.axhline(y=0.5, color='black', linestyle='--', alpha=0.2) # Horizontal line 
+    
+    # date_pd = pd.to_datetime(str(input_date))
+    # # date_formatted = date_pd.strftime('%B %d %Y')
+    # date_formatted = date_pd.strftime('%Y %m %d')
+    
+    # # ax.annotate("Pollen Allergy Index On " + date_formatted,xy=(0.5,0), xytext=(0,0), 
+    #                 #    xycoords='axes fraction', textcoords='offset points', ha='center', fontsize=14, 
+    #                 #    color='grey', weight='bold')
+    # ax.annotate("花粉过敏指数： " + date_formatted,xy=(0.5,0), xytext=(0,0), 
+    #                    xycoords='axes fraction', textcoords='offset points', ha='center', fontsize=14, 
+    #                    color='grey', weight='bold')
+   
+    # ax.annotate('Equatorial Line',xy=(0.9,0.43), xytext=(0,0), 
+    #                    xycoords='axes fraction', textcoords='offset points', ha='center', fontsize=7, 
+    #                    color='black', weight='bold')
+    
+    # Turn off the axes
+    # ax.xaxis.set_visible(False)
+    # ax.yaxis.set_visible(False)
+    ax.axis('off')
+    return fig
+
+@traced()
+def make_province_map(province_values, input_geo, provinces, input_date):
+    # Province overview: one value per ADM1 outline row, no ADM2 regions
+    fig, ax = plt.subplots(1,
+                           figsize = input_geo.figsize)
+    fig.set_facecolor('none')
+
+    input_geo.outline.plot(column=province_values, cmap='coolwarm', linewidth=0.1, ax=ax, edgecolor='grey',
+                           legend=False, vmin=0, vmax=3000, missing_kwds={'color': 'lightgrey', 'hatch': '///'})
+
+    for x, y, name, value in zip(provinces.label_x, provinces.label_y, provinces.names, province_values):
+        if not np.isnan(value):
+            ax.text(x, y, '%s\n%d' % (name, value), ha="center", va="center", size=4)
+
+    ax.axis('off')
+    return fig
+
+@traced()
+def make_bar(names, values, label, x, y):
+    # Figure Size
+    fig, ax = plt.subplots(figsize =(x, y))
+    
+    # Horizontal Bar Plot
+    color = 'lightblue'
+    ax.barh(names, values, color=color)
+    
+    # Remove axes splines
+    for s in ['top', 'bottom', 'left', 'right']:
+        ax.spines[s].set_visible(False)
+    
+    # Remove x, y Ticks
+    ax.xaxis.set_ticks_position('none')
+    ax.yaxis.set_ticks_position('none')
+    
+    # Add padding between axes and labels
+    ax.xaxis.set_tick_params(pad = 5)
+    ax.yaxis.set_tick_params(pad = 10)
+    
+    # Add x, y gridlines
+    ax.grid(visible = True, color ='grey',
+            linestyle ='-.', linewidth = 0.5,
+            alpha = 0.2)
+    
+    ax.invert_yaxis()
+    
+    # Add annotation to bars
+    for i in ax.patches:
+        plt.text(i.get_width()+0.2, i.get_y()+0.5, 
+                str(round((i.get_width()), 2)),
+                fontsize = 10, fontweight ='bold',
+                color ='lightblue')
+    
+    # Add Plot Title
+    # ax.set_title(label, loc ='left', )
+    
+    # Add Text watermark
+    fig.text(0.9, 0.15, 'robertyu', fontsize = 12,
+            color ='grey', ha ='right', va ='bottom',
+            alpha = 0.7)
+    
+    return fig
+
+    
+@dataclass
+class DataLine():
+    xlist: np.array
+    ylist: np.array
+    annotation: np.array
+    label: str
+
+def get_aqi_data(df, column_t, column_a, label_t, label_a):
+    # df is one city of the normalized AQI panel (see pollen_panels.py)
+    times = df['time'].to_numpy()
+    tempe_data = DataLine(times, df[column_t].to_numpy(), [], label_t)
+    aqi_data = DataLine(times, df[column_a].to_numpy(), [], label_a)
+    
+    return tempe_data, aqi_data    
+
+def get_weather_data(df, column_high, column_low, column_annotation, label_high, label_low):
+    # df is one city of the normalized weather panel (see pollen_panels.py)
+    times = df['time'].to_numpy()
+    high_data = DataLine(times, df[column_high].to_numpy(), df[column_annotation].to_numpy(), label_high)
+    low_data = DataLine(times, df[column_low].to_numpy(), df[column_annotation].to_numpy(), label_low)
+    
+    return high_data, low_data    
+        
+def downsample_line(data, n_out):
+    # LTTB on the line's points; annotations follow the kept points
+    if len(data.ylist) <= n_out:
+        return data
+    xlist = np.asarray(data.xlist)
+    ylist = np.asarray(data.ylist, dtype=np.float64)
+    idx = lttb_indices(mdates.date2num(xlist), ylist, n_out)
+    annotation = np.asarray(data.annotation)[idx] if len(data.annotation) else data.annotation
+    return DataLine(xlist[idx], ylist[idx], annotation, data.label)
+        
+@traced()
+def make_aqi_charts(ax, datas: list[DataLine], markers: list[str], colors: list[str], title: str):
+
+    ############################
+    # Init
+    
+    locator = mdates.AutoDateLocator(minticks=5, maxticks=11)
+    formatter = mdates.ConciseDateFormatter(locator)
+    formatter.formats = ['%y',  # ticks are mostly years
+                         '%y-%m',       # ticks are mostly months
+                         '%d',       # ticks are mostly days
+                         '%H:%M',    # hrs
+                         '%H:%M',    # min
+                         '%S.%f', ]  # secs
+    # these are mostly just the level above...
+    formatter.zero_formats = [''] + formatter.formats[:-1]
+    # ...except for ticks that are mostly hours, then it is nice to have
+    # month-day:
+    formatter.zero_formats[3] = '%m-%d'
+
+    formatter.offset_formats = ['',
+                                '%Y',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d %H:%M', ]
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(formatter)
+      
+    ax.grid(True)
+    ax.grid(which='major', color='#DDDDDD', linewidth=0.9)
+    ax.grid(which='minor', color='#CCCCCC', linestyle=':', linewidth=0.8)
+    ax.minorticks_on()
+
+    # Set title
+    ax.set_title(title)
+    
+    xmin = np.min(datas[0].xlist)
+    xmax = np.max(datas[0].xlist)
+    ymin = np.min(9999)
+    ymax = np.max(-9999)
+    
+    # Reduce long histories to the axes' pixel width, markers only when not reduced
+    budget = pixel_budget(ax)
+    datas = [downsample_line(data, budget) for data in datas]
+
+    charts = []
+    i = 0
+    for data in datas:
+        marker = markers[i] if len(data.ylist) < budget else None
+        chart = ax.plot(data.xlist, data.ylist, marker=marker, color= colors[i], linestyle='dotted', label=data.label)
+        charts.append(chart)
+        i += 1
+        if ymin > np.min(data.ylist):
+            ymin = np.min(data.ylist)
+        if ymax < np.max(data.ylist):
+            ymax = np.max(data.ylist)
+
+    # Set the limits for the X，Y axis
+    margin = abs(ymin // 5)
+    if abs(ymax // 5) > margin:
+        margin = abs(ymax // 5)
+    ax.set_ylim([ymin - margin, ymax + margin])
+    ax.set_xlim([xmin, xmax])
+    # ax.xaxis.axis_date(tz='Asia/Shanghai')
+    legend = ax.legend(loc='upper left', shadow=False, fontsize='medium')
+    legend.get_frame().set_facecolor('None')
+
+    # for i in range(25):
+    #     ax.annotate(i, xy=(datas[0].xlist[i], datas[0].ylist[i]))    
+    return charts
+
+@traced()
+def make_weather_charts(ax, datas: list[DataLine], markers: list[str], colors: list[str], title: str):
+
+    ############################
+    # Init
+    
+    locator = mdates.AutoDateLocator(minticks=5, maxticks=11)
+    formatter = mdates.ConciseDateFormatter(locator)
+    formatter.formats = ['%y',  # ticks are mostly years
+                         '%y-%m',       # ticks are mostly months
+                         '%d',       # ticks are mostly days
+                         '%H:%M',    # hrs
+                         '%H:%M',    # min
+                         '%S.%f', ]  # secs
+    # these are mostly just the level above...
+    formatter.zero_formats = [''] + formatter.formats[:-1]
+    # ...except for ticks that are mostly hours, then it is nice to have
+    # month-day:
+    formatter.zero_formats[3] = '%m-%d'
+
+    formatter.offset_formats = ['',
+                                '%Y',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d',
+                                '%Y-%m-%d %H:%M', ]
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(formatter)
+      
+    ax.grid(True)
+    ax.grid(which='major', color='#DDDDDD', linewidth=0.9)
+    ax.grid(which='minor', color='#CCCCCC', linestyle=':', linewidth=0.8)
+    ax.minorticks_on()
+
+    # Set title
+    ax.set_title(title)
+    
+    xmin = np.min(datas[0].xlist)
+    xmax = np.max(datas[0].xlist)
+    ymin = np.min(9999)
+    ymax = np.max(-9999)
+    
+    # Reduce long histories to the axes' pixel width, markers only when not reduced
+    budget = pixel_budget(ax)
+    datas = [downsample_line(data, budget) for data in datas]
+
+    charts = []
+    i = 0
+    for data in datas:
+        marker = markers[i] if len(data.ylist) < budget else None
+        chart = ax.plot(data.xlist, data.ylist, marker=marker, color= colors[i], linestyle='dotted', label=data.label)
+        charts.append(chart)
+        i += 1
+        if ymin > np.min(data.ylist):
+            ymin = np.min(data.ylist)
+        if ymax < np.max(data.ylist):
+            ymax = np.max(data.ylist)
+
+    # Set the limits for the X，Y axis
+    margin = abs(ymin // 5)
+    if abs(ymax // 5) > margin:
+        margin = abs(ymax // 5)
+    ax.set_ylim([ymin - margin, ymax + margin])
+    ax.set_xlim([xmin, xmax])
+    # ax.xaxis.axis_date(tz='Asia/Shanghai')
+    legend = ax.legend(loc='upper left', shadow=False, fontsize='medium')
+    legend.get_frame().set_facecolor('None')
+    for i in range(len(datas[0].annotation)):
+        ax.annotate(datas[0].annotation[i], xy=(datas[0].xlist[i], datas[0].ylist[i] + 1), fontsize=5)    
+    return charts
+
+
+def panel_title(prefix, names):
+    if len(names) <= 4:
+        return prefix + ' - '.join(names)
+    return prefix + '%d 个城市' % len(names)
+
+@traced()
+def make_full_aqi_charts(aqi_panel):
+    groups = [(city_name(city), df) for city, df in aqi_panel.groupby('city', observed=True, sort=True)]
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12,4))
+    if not groups:
+        return fig
+    
+    temperature, aqi = zip(*(get_aqi_data(df, "temperature", "aqi", name + "温度", name + '空气质量')
+                             for name, df in groups))
+    markers = [panel_markers[i % len(panel_markers)] for i in range(len(groups))]
+    colors = [compare_colors[i % len(compare_colors)] for i in range(len(groups))]
+    names = [name for name, _ in groups]
+    
+    make_aqi_charts(ax1, list(temperature), markers, colors, panel_title('温度 ', names))
+    make_aqi_charts(ax2, list(aqi), markers, colors, panel_title('空气质量 ', names))
+
+    # plt.gca().xaxis_date('Asia/Shanghai')
+    # plt.show()
+    return fig
+
+@traced()
+def make_full_weather_charts(weather_panel):
+    groups = [(city_name(city), df) for city, df in weather_panel.groupby('city', observed=True, sort=True)]
+    # Two forecasts per row, as many rows as needed
+    rows = max((len(groups) + 1) // 2, 1)
+    fig, axes = plt.subplots(rows, 2, figsize=(12, 4 * rows), squeeze=False)
+    
+    for ax, (name, df) in zip(axes.flat, groups):
+        high, low = get_weather_data(df, "high", "low", "weather", name + "最高温度", name + '最低温度')
+        make_weather_charts(ax, [high, low], ['o', 'x'], ['#00A88F', '#884b8f'], name + '未来15天天气预报')
+    for ax in axes.flat[len(groups):]:
+        ax.axis('off')
+
+    # plt.gca().xaxis_date('Asia/Shanghai')
+    # plt.show()
+    return fig
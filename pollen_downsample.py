@@ -0,0 +1,81 @@
+#######################
+# Time-series downsampling
+#
+# Long histories are reduced to about one point per output pixel before
+# plotting, so render time and image size stay bounded however much data
+# accumulates. Both methods return indices into the original arrays, so
+# callers can carry annotations or other columns along with the points.
+import numpy as np
+
+
+def minmax_indices(y, n_buckets):
+    """Indices of the min and max of each of `n_buckets` equal buckets.
+
+    Fully vectorized; keeps every peak and trough. NaN-only buckets keep one
+    NaN so gaps still break the plotted line.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_buckets <= 0 or n <= 2 * n_buckets:
+        return np.arange(n)
+    size = -(-n // n_buckets)
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:n] = y
+    blocks = padded.reshape(n_buckets, size)
+    nan = np.isnan(blocks)
+    lo = np.where(nan, np.inf, blocks).argmin(axis=1)
+    hi = np.where(nan, -np.inf, blocks).argmax(axis=1)
+    offsets = np.arange(n_buckets) * size
+    indices = np.concatenate(([0, n - 1], lo + offsets, hi + offsets))
+    return np.unique(indices[indices < n])
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: `n_out` indices that keep the visual shape."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    # Bucket edges for the n - 2 interior points, first and last are fixed
+    edges = (np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    # Bucket means of the finite points, used as the third triangle vertex,
+    # all at once; NaN for buckets that are all gap
+    interior_x, interior_y = x[1:n - 1], y[1:n - 1]
+    finite = ~np.isnan(interior_y)
+    starts = edges[:-1] - 1
+    counts = np.add.reduceat(finite.astype(np.int64), starts)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_x = np.append(np.add.reduceat(np.where(finite, interior_x, 0), starts) / counts, x[-1])
+        mean_y = np.append(np.add.reduceat(np.where(finite, interior_y, 0), starts) / counts, y[-1])
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    # The anchor is the last finite pick
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        bx, by = x[lo:hi], y[lo:hi]
+        # Before the first finite pick the next mean stands in for the anchor
+        ay = y[a] if not np.isnan(y[a]) else mean_y[i + 1]
+        if np.isnan(ay):
+            # No finite point on either side: keep the bucket's peak
+            area = by
+        elif np.isnan(mean_y[i + 1]):
+            # The next bucket is all gap: the point furthest from the anchor
+            area = np.abs(by - ay)
+        else:
+            # Twice the triangle area against the previous pick and the next mean
+            area = np.abs((x[a] - mean_x[i + 1]) * (by - ay) - (x[a] - bx) * (mean_y[i + 1] - ay))
+        # A NaN-only bucket picks its first point and keeps the gap
+        pick = lo + (int(np.nanargmax(area)) if not np.isnan(area).all() else 0)
+        indices[i + 1] = pick
+        if not np.isnan(y[pick]):
+            a = pick
+    return indices
+
+
+def pixel_budget(ax):
+    # Horizontal size of the axes in figure pixels
+    return max(int(ax.bbox.width), 2)
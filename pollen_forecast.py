@@ -0,0 +1,176 @@
+#######################
+# Pollen forecast
+#
+# One small linear model per city, fitted for every city at once:
+#
+#   y[t] - y[t-1] ~ 1 + y[t-1] + sin/cos(day of year)
+#
+# with y = log1p(num). The day-of-year harmonics are the seasonal baseline
+# and the lag term pulls the level back towards the city's usual range; the
+# ridge penalty shrinks every term, i.e. towards "tomorrow equals today",
+# which daily pollen is hard to beat on a single season of data. The design
+# is shared across cities as a (cities, days, features) array; fitting keeps
+# the per-city sufficient statistics X'X and X'y, so appending days only adds
+# their rows' contribution and re-solves the (cities, p, p) systems.
+# Statistics and coefficients are stored with the snapshot, so ingestion
+# refreshes them and server processes read them instead of refitting.
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from pollen_loader import memo, prime_memo
+from pollen_snapshot import load_derived, save_derived
+
+FORECAST_DAYS = 3
+# Ridge penalty, the best of benchmarks/backtest_forecast.py on the 2024
+# season: 3-day log1p MAE 1.005 against 1.010 for persistence, so the model
+# is only slightly better than "tomorrow equals today" on this much data
+RIDGE = 3000.0
+MIN_ROWS = 8
+
+
+def day_features(days):
+    doy = (np.asarray(days, dtype='datetime64[D]') - np.asarray(days, dtype='datetime64[Y]')).astype(np.float64)
+    angle = 2 * np.pi * doy / 365.25
+    return np.column_stack((np.ones(len(angle)), np.sin(angle), np.cos(angle)))
+
+
+def design(days, lagged):
+    """(cities, days, p) features for the rows `days` given y[t-1] in `lagged`."""
+    shared = day_features(days)
+    n_days, n_cities = lagged.shape
+    parts = [np.broadcast_to(shared[None, :, :1], (n_cities, n_days, 1)),
+             lagged.T[:, :, None],
+             np.broadcast_to(shared[None, :, 1:], (n_cities, n_days, 2))]
+    return np.concatenate(parts, axis=2)
+
+
+def statistics(store, lo, hi):
+    """X'X, X'y and row counts per city for target rows [lo, hi)."""
+    y = np.log1p(np.clip(store.matrix, 0, None)).astype(np.float64)
+    lo = max(lo, 1)
+    target, lagged = y[lo:hi], y[lo - 1:hi - 1]
+    X = design(store.days[lo:hi], lagged)
+    valid = ~(np.isnan(target.T) | np.isnan(X).any(axis=2))
+    X = np.where(valid[:, :, None], X, 0)
+    # The change from yesterday is the target, so shrinkage pulls towards persistence
+    t = np.where(valid, (target - lagged).T, 0)
+    return np.einsum('ctp,ctq->cpq', X, X), np.einsum('ctp,ct->cp', X, t), valid.sum(axis=1)
+
+
+@dataclass
+class ForecastModel():
+    cities: object        # pd.Index, column order of the store
+    first_day: object
+    n_rows: int           # store rows the statistics cover
+    xtx: np.ndarray       # (cities, p, p)
+    xty: np.ndarray       # (cities, p)
+    rows: np.ndarray      # (cities,) fitted rows per city
+    coef: np.ndarray      # (cities, p), NaN where too few rows
+    version: object = None
+    ridge: float = RIDGE
+
+    @classmethod
+    def from_arrays(cls, arrays, version):
+        return cls(pd.Index(arrays['cities']), arrays['first_day'][()], int(arrays['n_rows']),
+                   arrays['xtx'], arrays['xty'], arrays['rows'], arrays['coef'], version,
+                   float(arrays['ridge']))
+
+    def to_arrays(self):
+        return {'cities': np.asarray(self.cities, dtype=str), 'first_day': np.asarray(self.first_day),
+                'n_rows': np.asarray(self.n_rows), 'xtx': self.xtx, 'xty': self.xty, 'rows': self.rows,
+                'coef': self.coef, 'ridge': np.asarray(self.ridge)}
+
+    def solve(self):
+        p = self.xtx.shape[1]
+        penalty = self.ridge * np.eye(p)
+        self.coef = np.linalg.solve(self.xtx + penalty, self.xty[:, :, None])[:, :, 0]
+        self.coef[self.rows < MIN_ROWS] = np.nan
+        return self
+
+
+def fit_forecast(store):
+    xtx, xty, rows = statistics(store, 0, len(store.matrix))
+    return ForecastModel(store.cities, store.first_day, len(store.matrix), xtx, xty, rows,
+                         None, store.version).solve()
+
+
+def refresh_forecast(model, store, days):
+    """Fold newly appended days into the fit; refit from scratch otherwise."""
+    first_row = min(store.row(day) for day in days) if len(days) else len(store.matrix)
+    if (model.first_day != store.first_day or not model.cities.equals(store.cities)
+            or first_row < model.n_rows):
+        return fit_forecast(store)
+    # Rows from n_rows on are new; the last fitted row is the lag of the first
+    xtx, xty, rows = statistics(store, model.n_rows, len(store.matrix))
+    model.xtx, model.xty, model.rows = model.xtx + xtx, model.xty + xty, model.rows + rows
+    model.n_rows, model.version = len(store.matrix), store.version
+    return model.solve()
+
+
+def forecast(model, store, n_days=FORECAST_DAYS, origin=None):
+    """(days, values) for the n_days after `origin` (default: the last observed day).
+
+    values is (n_days, cities); NaN for cities without a fitted model.
+    """
+    last = np.flatnonzero(store.observed)[-1] if origin is None else store.row(origin)
+    # Level: each city's latest reading up to the last observed day
+    y = np.log1p(np.clip(store.matrix[:last + 1], 0, None))
+    seen = ~np.isnan(y)
+    latest = np.where(seen.any(axis=0), len(y) - 1 - np.argmax(seen[::-1], axis=0), 0)
+    level = y[latest, np.arange(y.shape[1])]
+
+    days = store.days[last] + np.arange(1, n_days + 1)
+    shared = day_features(days)
+    values = np.empty((n_days, len(level)))
+    for i in range(n_days):
+        x = [shared[i, 0] * np.ones_like(level), level, np.full_like(level, shared[i, 1]),
+             np.full_like(level, shared[i, 2])]
+        level = level + np.einsum('cp,pc->c', model.coef, np.array(x))
+        values[i] = level
+    return days, np.expm1(np.clip(values, 0, np.log1p(20000)))
+
+
+def forecast_frame(store, values, i):
+    # Day i of a forecast in the City/num layout of PollenStore.day_frame()
+    return pd.DataFrame({'City': store.city_column(), 'num': values[i].astype(np.float32)})
+
+
+def read_forecast(store, version):
+    # The model stored with the store's snapshot for data `version`, or None
+    if store.snapshot_dir is None:
+        return None
+    arrays = load_derived('forecast', version, store.snapshot_dir)
+    # Coefficients solved with another penalty are refitted
+    if arrays is None or 'ridge' not in arrays or float(arrays['ridge']) != RIDGE:
+        return None
+    return ForecastModel.from_arrays(arrays, version)
+
+
+def save_forecast(model, store):
+    if store.snapshot_dir is not None:
+        save_derived('forecast', model.version, model.to_arrays(), store.snapshot_dir)
+
+
+def load_forecast(store):
+    # One model per data version, shared by every session; normally read
+    # from the snapshot, fitted (and stored) only when it is missing there
+    def build():
+        model = read_forecast(store, store.version)
+        if model is None:
+            model = fit_forecast(store)
+            save_forecast(model, store)
+        return model
+
+    return memo('forecast', store.version, build)
+
+
+def update_forecast(store, days, previous_version):
+    # Appended days are folded into the statistics stored for the previous
+    # data version; a full fit when there are none.
+    previous = read_forecast(store, previous_version)
+    model = fit_forecast(store) if previous is None else refresh_forecast(previous, store, days)
+    save_forecast(model, store)
+    prime_memo('forecast', store.version, model)
+    return model
@@ -0,0 +1,161 @@
+#######################
+# Prepared map geometry
+#
+# The OCHA ADM2 layer is far more detailed than a (6, 4) inch figure can show.
+# prepare_geometry() keeps only the ADM2 regions we have pollen cities for,
+# adds a province outline for context, simplifies both to about half a pixel
+# at the target figure size and precomputes the label anchors. The result is
+# cached on disk and in-process, keyed by the shapefile, city list and size
+# (and the geopandas/shapely versions, whose pickles do not carry across).
+# With `province` set, only that ADM1 province is prepared, simplified for its
+# own extent: the regional tiles of the zoomable map (see pollen_tiles.py).
+#
+# The region outlines are also packed into one RegionBuffer: a single vertex
+# array with per-region offsets, which every patch-based renderer slices into
+# matplotlib paths instead of converting the shapely objects again. The raw
+# shapefile is read only to build the geometry and is not kept in memory.
+import hashlib
+import os
+import pickle
+from dataclasses import dataclass
+
+import numpy as np
+from matplotlib.path import Path
+
+from pollen_join import build_join_index, resolve_city_names
+from pollen_loader import CHINA_SHP, cached, file_signature, read_china_map
+from pollen_trace import span
+
+GEOMETRY_CACHE_DIR = 'data/geometry_cache'
+GEOMETRY_VERSION = 3
+# Simplification tolerance as a fraction of one output pixel
+PIXEL_TOLERANCE = 0.5
+
+
+@dataclass
+class RegionBuffer():
+    # float64 so the Paths built from it are views rather than copies
+    vertices: np.ndarray  # (n, 2) ring vertices of every region, in row order
+    codes: np.ndarray     # (n,) matplotlib Path codes
+    offsets: np.ndarray   # (regions + 1,) start of each region in `vertices`
+
+    def path(self, row):
+        lo, hi = self.offsets[row], self.offsets[row + 1]
+        return Path(self.vertices[lo:hi], self.codes[lo:hi])
+
+    def paths(self):
+        return [self.path(row) for row in range(len(self.offsets) - 1)]
+
+
+def region_buffer(geometry):
+    # One compound path per region, so patch collections have one face per
+    # row whatever geometry type (and geopandas version) it has.
+    rings, sizes = [], []
+    for geom in geometry:
+        polygons = getattr(geom, 'geoms', [geom])
+        region = [np.asarray(ring.coords, dtype=np.float64)[:, :2]
+                  for polygon in polygons for ring in (polygon.exterior, *polygon.interiors)]
+        rings += region
+        sizes.append(sum(len(ring) for ring in region))
+    vertices = np.concatenate(rings) if rings else np.empty((0, 2))
+    codes = np.full(len(vertices), Path.LINETO, dtype=Path.code_type)
+    ring_starts = np.cumsum([0] + [len(ring) for ring in rings])
+    codes[ring_starts[:-1]] = Path.MOVETO
+    codes[ring_starts[1:] - 1] = Path.CLOSEPOLY
+    return RegionBuffer(vertices, codes, np.concatenate(([0], np.cumsum(sizes))).astype(np.int64))
+
+
+@dataclass
+class PreparedGeometry():
+    regions: object    # GeoDataFrame of ADM2 rows with label_x / label_y
+    outline: object    # GeoDataFrame of dissolved ADM1 provinces
+    join: object       # JoinIndex from pollen cities to `regions` rows
+    figsize: tuple
+    dpi: int
+    crs: object = None
+    buffer: RegionBuffer = None
+    key: str = None    # load_prepared_geometry() cache key, versions derived indexes
+
+
+def simplify_tolerance(bounds, figsize, dpi):
+    minx, miny, maxx, maxy = bounds
+    # Map units per pixel along the axis that limits the aspect-fit
+    per_pixel = max((maxx - minx) / (figsize[0] * dpi), (maxy - miny) / (figsize[1] * dpi))
+    return per_pixel * PIXEL_TOLERANCE
+
+
+def prepare_geometry(china_map, cities, figsize=(6, 4), dpi=100, crs=None):
+    if crs is not None:
+        china_map = china_map.to_crs(crs)
+    tolerance = simplify_tolerance(china_map.total_bounds, figsize, dpi)
+
+    with span('geometry:dissolve'):
+        outline = china_map[['ADM1_PCODE', 'ADM1_EN', 'ADM1_ZH', 'geometry']].dissolve(
+            by='ADM1_PCODE', as_index=False)
+    with span('geometry:simplify'):
+        outline['geometry'] = outline.geometry.simplify(tolerance, preserve_topology=True)
+
+    names = resolve_city_names(china_map)
+    regions = china_map.loc[names.isin(set(cities)),
+                            ['ADM2_EN', 'ADM2_ZH', 'ADM2_PCODE', 'ADM1_PCODE', 'geometry']]
+    regions.insert(0, 'City', names[regions.index])
+    # Anchors come from the full-resolution polygons so labels do not move
+    # when the simplification tolerance changes.
+    with span('geometry:representative_point'):
+        anchors = regions.geometry.representative_point()
+    regions = regions.assign(label_x=anchors.x.to_numpy(np.float32),
+                             label_y=anchors.y.to_numpy(np.float32))
+    with span('geometry:simplify'):
+        regions['geometry'] = regions.geometry.simplify(tolerance, preserve_topology=True)
+    regions = regions.reset_index(drop=True)
+    with span('geometry:join'):
+        join = build_join_index(regions, cities)
+    return PreparedGeometry(regions, outline, join, tuple(figsize), dpi, crs,
+                            region_buffer(regions.geometry))
+
+
+def _library_versions():
+    import geopandas
+    import shapely
+
+    return geopandas.__version__, shapely.__version__
+
+
+def _cache_key(shp_path, cities, figsize, dpi, crs, province=None):
+    digest = hashlib.blake2b(digest_size=12)
+    for part in (GEOMETRY_VERSION, _library_versions(), file_signature(shp_path), sorted(cities),
+                 tuple(figsize), dpi, str(crs), province):
+        digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_prepared_geometry(cities, figsize=(6, 4), dpi=100, crs=None, shp_path=CHINA_SHP, province=None):
+    cities = sorted(set(cities))
+    key = _cache_key(shp_path, cities, figsize, dpi, crs, province)
+    cache_path = os.path.join(GEOMETRY_CACHE_DIR, key + '.pkl')
+
+    def build():
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    prepared = pickle.load(f)
+                prepared.key = key
+                return prepared
+            except Exception:
+                # Unreadable (truncated, or written by other library code):
+                # rebuild below and overwrite it
+                pass
+        # Read uncached: the full layer is only needed to build the geometry
+        china_map = read_china_map(shp_path)
+        if province is not None:
+            china_map = china_map[china_map.ADM1_PCODE == province]
+        prepared = prepare_geometry(china_map, cities, figsize, dpi, crs)
+        prepared.key = key
+        os.makedirs(GEOMETRY_CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(prepared, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        return prepared
+
+    return cached('geometry:' + key, [shp_path], build)
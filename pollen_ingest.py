@@ -0,0 +1,161 @@
+#######################
+# Incremental ingestion
+#
+# Appends new daily pollen readings and hourly AQI readings to their CSV
+# files and updates the in-memory structures in place instead of re-parsing
+# the whole history. The CSV append is O(new rows); the pollen snapshot is
+# rewritten from the updated store (a binary dump, no parsing), and the
+# aggregate tables and forecast statistics stored with it are refreshed for
+# the touched days only. Ingestion is idempotent: readings already present
+# with the same value are skipped, and a changed value is appended as a
+# correction (later rows win on load).
+#
+# Usage: python pollen_ingest.py pollen NEW.csv           (Date, City, num)
+#        python pollen_ingest.py aqi CITY NEW.csv         (time, temperature, aqi)
+import argparse
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+
+from pollen_loader import POLLEN_CSV, file_signature, prime
+from pollen_panels import DATA_DIR, LOCAL_TZ, discover, latest_readings, load_aqi_panel
+
+
+@dataclass
+class IngestResult():
+    rows: int = 0
+    appended: int = 0
+    days: list = field(default_factory=list)
+
+
+def append_csv(path, rows):
+    # Write `rows` in the file's own column order; unknown columns stay empty
+    header = pd.read_csv(path, nrows=0).columns
+    rows.reindex(columns=header).to_csv(path, mode='a', header=False, index=False)
+
+
+def ingest_pollen(rows, csv_path=POLLEN_CSV, snapshot_dir=None, prerender_days=True, image_dir=None):
+    from pollen_snapshot import SNAPSHOT_DIR, META_FILE, snapshot_from_store
+    from pollen_store import load_pollen_store
+
+    if (prerender_days and image_dir is None
+            and (os.path.abspath(csv_path) != os.path.abspath(POLLEN_CSV)
+                 or snapshot_dir not in (None, SNAPSHOT_DIR))):
+        # The default image store belongs to the default data
+        raise ValueError('pass image_dir (or prerender_days=False) to ingest outside the default paths')
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    rows = rows.loc[:, ['Date', 'City', 'num']].copy()
+    rows['Date'] = pd.to_datetime(rows['Date'], errors='coerce')
+    rows = rows.dropna(subset=['Date', 'City'])
+    result = IngestResult(rows=len(rows))
+
+    store = load_pollen_store(csv_path, snapshot_dir)
+    previous_version = store.version
+    changed = store.upsert(rows['Date'], rows['City'], rows['num'])
+    rows = rows[changed]
+    if rows.empty:
+        return result
+
+    # The CSV stays the source of truth; the snapshot is dumped from the
+    # updated store instead of re-parsing the CSV.
+    append_csv(csv_path, rows.assign(Date=rows['Date'].dt.strftime('%Y-%m-%d')))
+    snapshot_from_store(store, csv_path, snapshot_dir)
+    meta_path = os.path.join(snapshot_dir, META_FILE)
+    store.version, store.snapshot_dir = file_signature(meta_path), snapshot_dir
+    prime('pollen_store', [meta_path], store)
+
+    result.appended = len(rows)
+    result.days = sorted({day.date() for day in rows['Date']})
+    refresh_derived(store, result.days, previous_version, prerender_days, csv_path, image_dir)
+    return result
+
+
+def refresh_derived(store, days, previous_version, prerender_days=True, csv_path=POLLEN_CSV, image_dir=None):
+    from pollen_aggregates import update_aggregates
+    from pollen_forecast import update_forecast
+
+    # Rankings, tier counts and rolling stats are recomputed for the touched
+    # days (and the windows they fall in) only.
+    update_aggregates(store, days, previous_version)
+    # Appended days are folded into the forecast's sufficient statistics
+    update_forecast(store, days, previous_version)
+    # Pre-rendered day images are fingerprinted by their values, so only the
+    # touched days need rendering; every other day stays valid.
+    if prerender_days:
+        from pollen_prerender import ImageStore, image_store, load_map_geometry, prerender
+
+        out = image_store if image_dir is None else ImageStore(image_dir)
+        prerender(store, load_map_geometry(store), out, days=days, csv_path=csv_path,
+                  snapshot_dir=store.snapshot_dir)
+
+
+def ingest_aqi(city, rows, data_dir=DATA_DIR):
+    rows = rows.loc[:, ['time', 'temperature', 'aqi']].copy()
+    rows['time'] = pd.to_datetime(rows['time'])
+    if rows['time'].dt.tz is not None:
+        rows['time'] = rows['time'].dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+    rows = rows.drop_duplicates(subset=['time'], keep='last')
+    result = IngestResult(rows=len(rows))
+
+    panel = load_aqi_panel(data_dir)
+    existing = panel.loc[panel['city'] == city, ['time', 'temperature', 'aqi']]
+    # New times, and known times whose values changed (compared as stored)
+    merged = rows.merge(existing, on='time', how='left', suffixes=('', '_old'), indicator=True)
+    changed = merged['_merge'] == 'left_only'
+    for column in ('temperature', 'aqi'):
+        new, old = merged[column].astype('float32'), merged[column + '_old']
+        changed |= (new != old) & ~(new.isna() & old.isna())
+    rows = rows[changed.to_numpy()].sort_values('time')
+    if rows.empty:
+        return result
+
+    path = os.path.join(data_dir, 'aqi_%s.csv' % city)
+    column_t, column_a = city + '_t', city + '_a'
+    if not os.path.exists(path):
+        pd.DataFrame(columns=['', 'time', column_t, column_a]).to_csv(path, index=False)
+    # Same layout as the existing files: running index, offset-aware time
+    out = pd.DataFrame({
+        '': range(len(existing), len(existing) + len(rows)),
+        'time': [t.isoformat(sep=' ') for t in rows['time'].dt.tz_localize(LOCAL_TZ)],
+        column_t: rows['temperature'].to_numpy(),
+        column_a: rows['aqi'].to_numpy(),
+    })
+    out.to_csv(path, mode='a', header=False, index=False)
+
+    # Extend the cached panel with the new rows instead of re-reading files;
+    # a correction replaces the reading it follows, as on load
+    files = discover('aqi', data_dir)
+    new_rows = pd.DataFrame({'city': city, 'time': rows['time'].to_numpy(),
+                             'temperature': rows['temperature'].to_numpy('float32'),
+                             'aqi': rows['aqi'].to_numpy('float32')})
+    updated = pd.concat([panel.astype({'city': str}), new_rows], ignore_index=True)
+    updated['city'] = updated['city'].astype('category')
+    prime('panel:aqi:%s' % data_dir, list(files.values()), latest_readings(updated))
+
+    result.appended = len(rows)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Append new pollen or AQI readings.')
+    sub = parser.add_subparsers(dest='kind', required=True)
+    pollen = sub.add_parser('pollen', help='daily pollen readings: Date, City, num')
+    pollen.add_argument('path')
+    pollen.add_argument('--no-prerender', action='store_true', help='skip re-rendering touched days')
+    aqi = sub.add_parser('aqi', help='hourly readings for one city: time, temperature, aqi')
+    aqi.add_argument('city')
+    aqi.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.kind == 'pollen':
+        result = ingest_pollen(pd.read_csv(args.path), prerender_days=not args.no_prerender)
+        print('pollen: %d rows, %d new or changed, %d days touched'
+              % (result.rows, result.appended, len(result.days)))
+    else:
+        result = ingest_aqi(args.city, pd.read_csv(args.path))
+        print('aqi %s: %d rows, %d new or changed' % (args.city, result.rows, result.appended))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#######################
+# City -> ADM2 join index
+#
+# Pollen data names cities in pinyin, the OCHA shapefile in English. The join
+# index resolves both once: every geometry row gets the code of the pollen
+# city it belongs to, so a day's values can be scattered onto the geometry
+# with a single fancy-index instead of two GeoDataFrame merges per render.
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# ADM2_ZH -> pollen City, for regions whose ADM2_EN differs from our naming
+ADM2_ALIASES = {
+    '西安市': 'Xian',
+    '哈尔滨市': 'Haerbin',
+    '呼和浩特市': 'Huhehaote',
+    '鄂尔多斯市': 'Eerduosi',
+    '乌鲁木齐市': 'Wulumuqi',
+    '重庆市': 'Chongqing',
+}
+
+
+def resolve_city_names(gdf):
+    return gdf.ADM2_ZH.map(ADM2_ALIASES).fillna(gdf.ADM2_EN)
+
+
+@dataclass
+class JoinIndex():
+    cities: pd.Index        # pollen city names, position = city code
+    row_codes: np.ndarray   # city code of each geometry row
+
+    def city_codes(self, names):
+        # -1 for names the index does not know
+        return self.cities.get_indexer(pd.Index(names))
+
+    def scatter(self, names, values, out=None):
+        """Return `values` (one per city name) aligned with the geometry rows."""
+        by_city = np.full(len(self.cities) + 1, np.nan, dtype=np.float64)
+        codes = self.city_codes(names)
+        known = codes >= 0
+        by_city[codes[known]] = np.asarray(values, dtype=np.float64)[known]
+        # Unmatched rows carry code -1 and pick up the trailing NaN slot
+        return np.take(by_city, self.row_codes, out=out)
+
+
+def build_join_index(gdf, cities):
+    cities = pd.Index(cities)
+    row_codes = cities.get_indexer(resolve_city_names(gdf)).astype(np.int32)
+    return JoinIndex(cities, row_codes)
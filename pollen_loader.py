@@ -0,0 +1,131 @@
+#######################
+# Process-wide data cache
+#
+# Streamlit re-executes pollen_web.py on every widget interaction, but imported
+# modules stay alive for the whole server process. Datasets cached here are
+# therefore shared by every session and every rerun, and are only rebuilt when
+# one of their source files changes on disk. memo() does the same for values
+# derived from other data, rebuilt when that data's version changes.
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+
+import pandas as pd
+
+from pollen_trace import span, traced
+
+POLLEN_CSV = 'data/pollen_optimize.csv'
+CHINA_SHP = 'data/chn_admbnda_adm2_ocha_2020.shp'
+
+
+@dataclass
+class CacheStats():
+    hits: int = 0
+    misses: int = 0
+
+
+# _lock guards the dicts only; builds hold the lock of their own entry, so a
+# cold build of one dataset never stalls lookups of the others.
+_lock = threading.Lock()
+_entries = {}
+_stats = {}
+_build_locks = {}
+
+
+def file_signature(path, use_hash=False):
+    # mtime and size are enough for files replaced by our own tooling;
+    # use_hash guards against editors/rsync that preserve mtimes.
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    if use_hash:
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        signature += (digest.hexdigest(),)
+    return signature
+
+
+def _hit(name, signature):
+    # Under _lock: the cached value if it is current, else None
+    entry = _entries.get(name)
+    if entry is not None and entry[0] == signature:
+        _stats[name].hits += 1
+        return entry
+    return None
+
+
+def _lookup(name, signature, builder):
+    with _lock:
+        _stats.setdefault(name, CacheStats())
+        entry = _hit(name, signature)
+        if entry is not None:
+            return entry[1]
+        build_lock = _build_locks.setdefault(name, threading.RLock())
+    # Sessions missing the same entry wait for one build instead of parsing
+    # the same file twice on a cold start.
+    with build_lock:
+        with _lock:
+            entry = _hit(name, signature)
+            if entry is not None:
+                return entry[1]
+            _stats[name].misses += 1
+        with span('build:' + name.split(':')[0]):
+            value = builder()
+        with _lock:
+            _entries[name] = (signature, value)
+        return value
+
+
+def cached(name, paths, builder, use_hash=False):
+    """Return builder() shared across sessions, rebuilt when `paths` change."""
+    return _lookup(name, tuple(file_signature(p, use_hash) for p in paths), builder)
+
+
+def prime(name, paths, value):
+    # Install a value built elsewhere (e.g. updated incrementally) so the
+    # next cached() call for `paths` is a hit instead of a rebuild.
+    signature = tuple(file_signature(p) for p in paths)
+    with _lock:
+        _entries[name] = (signature, value)
+
+
+def memo(name, version, builder):
+    """Return builder() shared across sessions, rebuilt when `version` changes.
+
+    For values derived from other cached data rather than read from files,
+    keyed by the version of what they were derived from.
+    """
+    return _lookup(name, ('version', version), builder)
+
+
+def prime_memo(name, version, value):
+    with _lock:
+        _entries[name] = (('version', version), value)
+
+
+def cache_stats():
+    with _lock:
+        return {name: CacheStats(s.hits, s.misses) for name, s in _stats.items()}
+
+
+def clear_cache():
+    with _lock:
+        _entries.clear()
+        _stats.clear()
+
+
+@traced()
+def read_pollen_csv(path=POLLEN_CSV):
+    pollen_data = pd.read_csv(path, usecols=['Date', 'num', 'City'])
+    pollen_data = pollen_data.loc[:, ['Date', 'num', 'City']]
+    pollen_data['Date'] = pd.to_datetime(pollen_data['Date'], errors='coerce')
+    return pollen_data
+
+
+@traced()
+def read_china_map(path=CHINA_SHP):
+    import geopandas as gpd
+
+    return gpd.read_file(path)
@@ -0,0 +1,119 @@
+#######################
+# AQI / weather panel registry
+#
+# Discovers every data/aqi_<city>.csv and data/weather_<city>.csv, normalizes
+# their schemas into one long-format frame per kind and caches it process-wide.
+# Adding a monitored city means dropping in its files (and optionally a
+# display name below); nothing is re-read until one of the files changes.
+import glob
+import os
+import re
+
+import pandas as pd
+
+from pollen_loader import cached, file_signature
+
+DATA_DIR = 'data'
+LOCAL_TZ = 'Asia/Shanghai'
+# Display names by file-name suffix; unknown cities show the suffix itself
+CITY_NAMES = {
+    'beijing': '北京',
+    'chifeng': '赤峰',
+}
+PANEL_COLUMNS = {
+    'aqi': ['city', 'time', 'temperature', 'aqi'],
+    'weather': ['city', 'time', 'high', 'low', 'weather'],
+}
+
+
+def city_name(city):
+    return CITY_NAMES.get(city, city)
+
+
+def discover(kind, data_dir=DATA_DIR):
+    """{city: path} for every <kind>_<city>.csv in `data_dir`, sorted by city."""
+    pattern = re.compile(r'^%s_(\w+)\.csv$' % kind)
+    files = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, '%s_*.csv' % kind))):
+        match = pattern.match(os.path.basename(path))
+        if match:
+            files[match.group(1)] = path
+    return files
+
+
+def to_local_naive(values):
+    # Vectorized replacement for [t.replace(tzinfo=None) for t in ...].
+    # Offset-aware times are parsed as UTC, so mixed offsets are fine, and
+    # shown as local wall time; naive times already are local wall time.
+    values = pd.Series(values)
+    aware = values.astype(str).str.contains(r'(?:[+-]\d{2}:?\d{2}|Z)$')
+    local = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    if aware.any():
+        local[aware] = pd.to_datetime(values[aware], utc=True).dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+    if not aware.all():
+        local[~aware] = pd.to_datetime(values[~aware])
+    return local
+
+
+def read_aqi_csv(path, city):
+    # Columns are <city>_t (temperature) and <city>_a (AQI)
+    df = pd.read_csv(path)
+    temperature = [c for c in df.columns if c.endswith('_t')][0]
+    aqi = [c for c in df.columns if c.endswith('_a')][0]
+    return pd.DataFrame({
+        'city': city,
+        'time': to_local_naive(df['time']),
+        'temperature': df[temperature].astype('float32'),
+        'aqi': df[aqi].astype('float32'),
+    })
+
+
+def read_weather_csv(path, city):
+    df = pd.read_csv(path)
+    return pd.DataFrame({
+        'city': city,
+        'time': to_local_naive(df['日期']),
+        'high': df['最高气温'].astype('float32'),
+        'low': df['最低气温'].astype('float32'),
+        'weather': df['天气'],
+    })
+
+
+READERS = {
+    'aqi': read_aqi_csv,
+    'weather': read_weather_csv,
+}
+
+
+def read_panel(kind, files):
+    frames = [READERS[kind](path, city) for city, path in files.items()]
+    if not frames:
+        return pd.DataFrame(columns=PANEL_COLUMNS[kind])
+    panel = pd.concat(frames, ignore_index=True)
+    panel['city'] = panel['city'].astype('category')
+    return latest_readings(panel)
+
+
+def latest_readings(panel):
+    # Sorted by city and time; of repeated readings (appended corrections)
+    # the one written last wins
+    panel = panel.sort_values(['city', 'time'], kind='stable', ignore_index=True)
+    return panel.drop_duplicates(['city', 'time'], keep='last', ignore_index=True)
+
+
+def load_panel(kind, data_dir=DATA_DIR):
+    files = discover(kind, data_dir)
+    return cached('panel:%s:%s' % (kind, data_dir), list(files.values()), lambda: read_panel(kind, files))
+
+
+def panel_version(kind, data_dir=DATA_DIR):
+    # Cache key for charts drawn from the panel
+    return tuple((city, file_signature(path)) for city, path in discover(kind, data_dir).items())
+
+
+def load_aqi_panel(data_dir=DATA_DIR):
+    return load_panel('aqi', data_dir)
+
+
+def load_weather_panel(data_dir=DATA_DIR):
+    return load_panel('weather', data_dir)
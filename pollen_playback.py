@@ -0,0 +1,179 @@
+#######################
+# Pollen map playback
+#
+# Steps the pollen map through a range of days. The province outline, region
+# edges and background are drawn once; each frame only swaps the color array
+# of the region collection, the visible labels and the date caption, and
+# blits those onto the saved background. Frames are exported as an animated
+# GIF (Pillow) or MP4 (ffmpeg, through matplotlib's animation writers).
+# Longer ranges are strided down to PLAYBACK_MAX_FRAMES frames, so the render
+# time and GIF size stay bounded however much history is selected.
+#
+# Usage: python pollen_playback.py OUT.gif|OUT.mp4 [--start D] [--end D] [--fps N] [--max-frames N]
+import argparse
+import io
+
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation, writers
+from matplotlib.collections import PatchCollection
+from matplotlib.colors import Normalize
+from matplotlib.patches import PathPatch
+import numpy as np
+
+from pollen_trace import traced
+
+PLAYBACK_DPI = 100
+PLAYBACK_FPS = 4
+PLAYBACK_MAX_FRAMES = 120
+# Range the dashboard plays by default, ending on the latest day
+PLAYBACK_DEFAULT_DAYS = 30
+
+
+def playback_stride(n_days, max_frames=PLAYBACK_MAX_FRAMES):
+    # Days per frame so that n_days fit in max_frames (0 or None: no cap)
+    return max(-(-n_days // max_frames), 1) if max_frames else 1
+
+
+def playback_days(store, start=None, end=None, max_frames=PLAYBACK_MAX_FRAMES):
+    """Observed days between `start` and `end` (inclusive), oldest first.
+
+    Past `max_frames` days every n-th day is kept, counted back from the last.
+    """
+    days = [day for day in store.day_list() if (start is None or day >= start) and (end is None or day <= end)]
+    return days[::playback_stride(len(days), max_frames)][::-1]
+
+
+class PlaybackMap():
+    """The pollen map with a fixed base and per-day region colors."""
+
+    def __init__(self, geo, dpi=PLAYBACK_DPI):
+        self.geo = geo
+        self.fig, self.ax = plt.subplots(1, figsize=geo.figsize, dpi=dpi)
+        self.fig.set_facecolor('white')
+
+        # Same look as make_pollen_map; missing regions stay transparent so
+        # the hatched outline underneath shows through.
+        geo.outline.plot(ax=self.ax, color='lightgrey', edgecolor='grey', linewidth=0.1, hatch='///')
+        cmap = plt.get_cmap('coolwarm').copy()
+        cmap.set_bad(alpha=0)
+        # Region paths are views of the prepared geometry's shared vertex buffer
+        self.regions = PatchCollection([PathPatch(path) for path in geo.buffer.paths()],
+                                       cmap=cmap, norm=Normalize(vmin=0, vmax=3000),
+                                       edgecolor='grey', linewidth=0.1, animated=True)
+        self.regions.set_array(np.full(len(geo.regions), np.nan))
+        self.ax.add_collection(self.regions)
+
+        self.labels = [self.ax.text(x, y, region[:5], ha='center', va='center', size=4,
+                                    visible=False, animated=True)
+                       for x, y, region in zip(geo.regions.label_x, geo.regions.label_y, geo.regions.ADM2_ZH)]
+        self.caption = self.ax.annotate('', xy=(0.5, 0), xycoords='axes fraction', ha='center',
+                                        fontsize=14, color='grey', weight='bold', animated=True)
+        self.ax.axis('off')
+        self.background = None
+
+    @property
+    def artists(self):
+        return [self.regions, *self.labels, self.caption]
+
+    def update(self, store, day):
+        values = self.geo.join.scatter(store.cities, store.day(day))
+        self.regions.set_array(np.ma.masked_invalid(values))
+        has_value = ~np.isnan(values)
+        for label, visible in zip(self.labels, has_value):
+            label.set_visible(bool(visible) and not np.isnan(label.get_position()[0]))
+        self.caption.set_text('花粉过敏指数： ' + day.strftime('%Y-%m-%d'))
+        return self.artists
+
+    def frame(self, store, day):
+        """RGBA array of `day`, blitted onto the cached background."""
+        canvas = self.fig.canvas
+        if self.background is None:
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+        canvas.restore_region(self.background)
+        for artist in self.update(store, day):
+            self.ax.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
+        return np.asarray(canvas.buffer_rgba()).copy()
+
+    def frames(self, store, days):
+        for day in days:
+            yield self.frame(store, day)
+
+    def animation(self, store, days, fps=PLAYBACK_FPS):
+        # For interactive backends and matplotlib's movie writers
+        return FuncAnimation(self.fig, lambda day: self.update(store, day), frames=days,
+                             interval=1000 / fps, blit=True, repeat=False)
+
+    def close(self):
+        plt.close(self.fig)
+
+
+def frames_to_gif(frames, fps=PLAYBACK_FPS):
+    from PIL import Image
+
+    images = [Image.fromarray(frame).convert('RGB') for frame in frames]
+    if not images:
+        return b''
+    out = io.BytesIO()
+    images[0].save(out, format='GIF', save_all=True, append_images=images[1:],
+                   duration=int(1000 / fps), loop=0, optimize=True)
+    return out.getvalue()
+
+
+@traced()
+def make_playback_gif(store, geo, start=None, end=None, fps=PLAYBACK_FPS, dpi=PLAYBACK_DPI,
+                      max_frames=PLAYBACK_MAX_FRAMES):
+    """Animated GIF bytes of the pollen map from `start` to `end`."""
+    playback = PlaybackMap(geo, dpi)
+    try:
+        return frames_to_gif(playback.frames(store, playback_days(store, start, end, max_frames)), fps)
+    finally:
+        playback.close()
+
+
+def export_playback(store, geo, path, start=None, end=None, fps=PLAYBACK_FPS, dpi=PLAYBACK_DPI,
+                    max_frames=PLAYBACK_MAX_FRAMES):
+    days = playback_days(store, start, end, max_frames)
+    if path.lower().endswith('.gif'):
+        with open(path, 'wb') as f:
+            f.write(make_playback_gif(store, geo, start, end, fps, dpi, max_frames))
+    else:
+        # MP4 and friends need ffmpeg on PATH
+        if not writers.is_available('ffmpeg'):
+            raise RuntimeError('ffmpeg not found, export %s as .gif instead' % path)
+        playback = PlaybackMap(geo, dpi)
+        try:
+            playback.animation(store, days, fps).save(path, writer='ffmpeg', fps=fps, dpi=dpi)
+        finally:
+            playback.close()
+    return days
+
+
+def main(argv=None):
+    from datetime import date
+
+    parser = argparse.ArgumentParser(description='Export the pollen map as an animation.')
+    parser.add_argument('out', help='output file, .gif or .mp4')
+    parser.add_argument('--start', type=date.fromisoformat, default=None, help='first day (YYYY-MM-DD)')
+    parser.add_argument('--end', type=date.fromisoformat, default=None, help='last day (YYYY-MM-DD)')
+    parser.add_argument('--fps', type=float, default=PLAYBACK_FPS)
+    parser.add_argument('--dpi', type=int, default=PLAYBACK_DPI)
+    parser.add_argument('--max-frames', type=int, default=PLAYBACK_MAX_FRAMES,
+                        help='stride longer ranges down to this many frames (0: every day)')
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import pollen_charts  # noqa: F401  registers the Chinese font
+    from pollen_prerender import load_map_geometry
+    from pollen_store import load_pollen_store
+
+    store = load_pollen_store()
+    days = export_playback(store, load_map_geometry(store), args.out, args.start, args.end, args.fps, args.dpi,
+                           args.max_frames)
+    print('%d frames -> %s' % (len(days), args.out))
+
+
+if __name__ == '__main__':
+    main()
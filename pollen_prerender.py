@@ -0,0 +1,199 @@
+#######################
+# Daily chart pre-rendering
+#
+# Renders the pollen map and the top-10 bar chart for every observed day into
+# an on-disk image store, spreading the work over a process pool. Each day is
+# fingerprinted by its values, so reruns only render days that are new or
+# whose data changed. The dashboard serves these images when they match.
+#
+# Usage: python pollen_prerender.py [--workers N] [--force] [--out DIR]
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from pollen_loader import POLLEN_CSV, cached
+from pollen_render_cache import RENDER_KWARGS, figure_to_png
+
+IMAGE_STORE_DIR = 'data/prerender'
+MANIFEST_FILE = 'manifest.json'
+# Bump when the chart builders change in a way that invalidates old images
+PRERENDER_VERSION = 3
+
+
+def load_map_geometry(store):
+    from pollen_charts import MAP_FIGSIZE
+    from pollen_geometry import load_prepared_geometry
+    from pollen_render_cache import RENDER_DPI
+
+    return load_prepared_geometry(store.cities, figsize=MAP_FIGSIZE, dpi=RENDER_DPI)
+
+
+def build_day_map(store, geo, day):
+    from pollen_charts import make_pollen_map
+
+    return make_pollen_map(store.day_frame(day), geo, day)
+
+
+def build_day_bar(store, geo, day):
+    from pollen_aggregates import load_aggregates
+    from pollen_charts import make_bar
+
+    names, values = load_aggregates(store).top(day)
+    return make_bar(names, values, '花粉最多十城市', 5, 5)
+
+
+DAY_CHARTS = {
+    'map': build_day_map,
+    'bar': build_day_bar,
+}
+
+
+def render_version(geo):
+    return repr((PRERENDER_VERSION, sorted(RENDER_KWARGS.items()), geo.figsize, geo.dpi, len(geo.regions)))
+
+
+def day_digest(store, day):
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update('\0'.join(store.cities).encode('utf-8'))
+    digest.update(np.ascontiguousarray(store.day(day)).tobytes())
+    return digest.hexdigest()
+
+
+class ImageStore():
+
+    def __init__(self, root=IMAGE_STORE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_FILE)
+
+    def manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {'version': None, 'days': {}}
+        # Shared by all sessions, re-read only when the CLI rewrites it
+        return cached('prerender:' + os.path.abspath(self.manifest_path), [self.manifest_path],
+                      self._read_manifest)
+
+    def _read_manifest(self):
+        with open(self.manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def image_path(self, day, kind):
+        return os.path.join(self.root, '%s_%s.png' % (day, kind))
+
+    def save(self, day, kind, png):
+        os.makedirs(self.root, exist_ok=True)
+        path = self.image_path(day, kind)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(png)
+        os.replace(path + '.tmp', path)
+
+    def load(self, day, kind, digest, version):
+        """PNG bytes for a day if the stored image matches `digest`, else None."""
+        manifest = self.manifest()
+        if manifest['version'] != version or manifest['days'].get(str(day)) != digest:
+            return None
+        try:
+            with open(self.image_path(day, kind), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+image_store = ImageStore()
+
+
+def load_day_chart(kind, store, geo, day):
+    """Pre-rendered PNG bytes for `day` when current, otherwise a new figure."""
+    png = image_store.load(day, kind, day_digest(store, day), render_version(geo))
+    if png is not None:
+        return png
+    return DAY_CHARTS[kind](store, geo, day)
+
+
+#######################
+# Worker processes
+_worker_state = None
+
+
+def _init_worker(csv_path, snapshot_dir):
+    global _worker_state
+    import matplotlib
+    matplotlib.use('Agg')
+    from pollen_store import load_pollen_store
+
+    # The same data the parent fingerprinted the days from
+    store = load_pollen_store(csv_path, snapshot_dir)
+    # Parent has already prepared the geometry, workers read the disk cache
+    _worker_state = (store, load_map_geometry(store))
+
+
+def _render_day(day, root):
+    store, geo = _worker_state
+    out = ImageStore(root)
+    for kind, builder in DAY_CHARTS.items():
+        out.save(day, kind, figure_to_png(builder(store, geo, day)))
+    return day
+
+
+def stale_days(store, geo, out, force=False, days=None):
+    manifest = out.manifest() if not force else {'version': None, 'days': {}}
+    fresh = manifest['version'] == render_version(geo)
+    candidates = store.day_list() if days is None else days
+    days = {}
+    for day in candidates:
+        digest = day_digest(store, day)
+        if force or not fresh or manifest['days'].get(str(day)) != digest:
+            days[day] = digest
+    return days
+
+
+def prerender(store, geo, out=image_store, workers=None, force=False, days=None, csv_path=POLLEN_CSV,
+              snapshot_dir=None):
+    # `days` limits the check to those days (e.g. the ones just ingested);
+    # csv_path and snapshot_dir are where the workers load `store` from
+    todo = stale_days(store, geo, out, force, days)
+    manifest = out.manifest()
+    days = dict(manifest['days']) if manifest['version'] == render_version(geo) and not force else {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(csv_path, snapshot_dir)) as pool:
+            futures = [pool.submit(_render_day, day, out.root) for day in todo]
+            for future in as_completed(futures):
+                day = future.result()
+                days[str(day)] = todo[day]
+    # Drop days that no longer exist in the data
+    current = {str(day) for day in store.day_list()}
+    days = {day: digest for day, digest in days.items() if day in current}
+    out.write_manifest({'version': render_version(geo), 'days': days})
+    return sorted(todo)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-render daily pollen charts.')
+    parser.add_argument('--workers', type=int, default=None, help='process pool size (default: CPU count)')
+    parser.add_argument('--force', action='store_true', help='re-render every day')
+    parser.add_argument('--out', default=IMAGE_STORE_DIR, help='image store directory')
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    from pollen_store import load_pollen_store
+
+    store = load_pollen_store()
+    geo = load_map_geometry(store)
+    rendered = prerender(store, geo, ImageStore(args.out), args.workers, args.force)
+    print('rendered %d of %d days into %s' % (len(rendered), len(store.day_list()), args.out))
+
+
+if __name__ == '__main__':
+    main()
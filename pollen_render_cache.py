@@ -0,0 +1,98 @@
+#######################
+# Rendered figure cache
+#
+# Rasterizing matplotlib figures is the main CPU cost of a rerun. Charts are
+# rendered to PNG once per distinct key (the chart's real inputs) and served
+# from a process-wide LRU cache bounded by total bytes.
+import io
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from pollen_trace import span
+
+# Same output settings st.pyplot uses
+RENDER_DPI = 200
+RENDER_KWARGS = {'format': 'png', 'dpi': RENDER_DPI, 'bbox_inches': 'tight'}
+
+
+@dataclass
+class FigureCacheStats():
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    nbytes: int = 0
+
+
+def figure_to_png(fig):
+    import matplotlib.pyplot as plt
+
+    buf = io.BytesIO()
+    with span('png_encode'):
+        fig.savefig(buf, **RENDER_KWARGS)
+    # Figures made with plt.subplots stay registered with pyplot until closed
+    plt.close(fig)
+    return buf.getvalue()
+
+
+class FigureCache():
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = FigureCacheStats()
+
+    def get(self, key):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is None:
+                self._stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats.hits += 1
+            return png
+
+    def put(self, key, png):
+        if len(png) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._stats.nbytes -= len(old)
+            self._entries[key] = png
+            self._stats.nbytes += len(png)
+            while self._stats.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._stats.nbytes -= len(evicted)
+                self._stats.evictions += 1
+
+    def render(self, key, builder, *args, **kwargs):
+        """PNG bytes for `key`, calling builder(*args, **kwargs) on a miss.
+
+        The builder returns a figure, or PNG bytes it already has on hand.
+        """
+        png = self.get(key)
+        if png is None:
+            # Rendering happens outside the lock; two sessions missing the
+            # same key at once both render, which is cheaper than serializing
+            # every render in the process.
+            png = builder(*args, **kwargs)
+            if not isinstance(png, bytes):
+                png = figure_to_png(png)
+            self.put(key, png)
+        return png
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._stats.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return FigureCacheStats(self._stats.hits, self._stats.misses, self._stats.evictions,
+                                    len(self._entries), self._stats.nbytes)
+
+
+figure_cache = FigureCache()
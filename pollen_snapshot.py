@@ -0,0 +1,194 @@
+#######################
+# Columnar pollen snapshot
+#
+# Compiles data/pollen_optimize.csv into typed numpy columns sorted by day:
+#   days.npy         int32  distinct day ordinals (days since 1970-01-01)
+#   day_offsets.npy  int64  row offset of each day partition (len(days) + 1)
+#   city.npy         int16  city code per row, see meta.json "cities"
+#   num.npy          float32 pollen index per row
+# meta.json is written last and records the source CSV it was built from.
+# When the CSV is touched without changing (checkout, copy), the new stat is
+# recorded in source.json after a content match, leaving meta.json and so the
+# data version (and the tables derived for it) as they were.
+# Tables derived from the data (aggregates, forecast statistics) are stored
+# next to it as <name>.npz, stamped with the data version they were built for,
+# so ingestion can refresh them and every server process can read them.
+#
+# Usage: python pollen_snapshot.py [csv_path] [snapshot_dir]
+import json
+import os
+import sys
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+
+from pollen_loader import POLLEN_CSV, file_signature, read_pollen_csv
+
+SNAPSHOT_DIR = 'data/pollen_snapshot'
+SNAPSHOT_VERSION = 1
+META_FILE = 'meta.json'
+SOURCE_FILE = 'source.json'
+
+
+@dataclass
+class PollenSnapshot():
+    days: np.ndarray
+    day_offsets: np.ndarray
+    city: np.ndarray
+    num: np.ndarray
+    cities: list
+
+    @property
+    def row_days(self):
+        # Expand the day partitions back to one ordinal per row
+        return np.repeat(self.days, np.diff(self.day_offsets))
+
+
+def compile_snapshot(csv_path=POLLEN_CSV, snapshot_dir=SNAPSHOT_DIR):
+    pollen_data = read_pollen_csv(csv_path)
+    pollen_data = pollen_data.dropna(subset=['Date', 'City'])
+    city = pollen_data['City'].astype('category')
+    ordinals = pollen_data['Date'].to_numpy().astype('datetime64[D]').astype(np.int32)
+    return write_snapshot(ordinals, city.cat.codes.to_numpy(), pollen_data['num'].to_numpy(),
+                          list(city.cat.categories), csv_path, snapshot_dir)
+
+
+def snapshot_from_store(store, csv_path=POLLEN_CSV, snapshot_dir=SNAPSHOT_DIR):
+    # Binary dump of a PollenStore, used after incremental ingestion so the
+    # CSV does not have to be parsed again.
+    rows, codes = np.nonzero(~np.isnan(store.matrix))
+    ordinals = store.first_day.astype(np.int64) + rows
+    return write_snapshot(ordinals.astype(np.int32), codes, store.matrix[rows, codes],
+                          list(store.cities), csv_path, snapshot_dir)
+
+
+def write_snapshot(ordinals, codes, num, cities, csv_path=POLLEN_CSV, snapshot_dir=SNAPSHOT_DIR):
+    codes = np.asarray(codes).astype(np.int16)
+    order = np.lexsort((codes, ordinals))
+    ordinals = ordinals[order]
+    days, starts = np.unique(ordinals, return_index=True)
+    day_offsets = np.append(starts, len(ordinals)).astype(np.int64)
+
+    os.makedirs(snapshot_dir, exist_ok=True)
+    meta_path = os.path.join(snapshot_dir, META_FILE)
+    if os.path.exists(meta_path):
+        # Invalidate the old snapshot before touching its columns
+        os.remove(meta_path)
+    np.save(os.path.join(snapshot_dir, 'days.npy'), days.astype(np.int32))
+    np.save(os.path.join(snapshot_dir, 'day_offsets.npy'), day_offsets)
+    np.save(os.path.join(snapshot_dir, 'city.npy'), codes[order])
+    np.save(os.path.join(snapshot_dir, 'num.npy'), np.asarray(num, dtype=np.float32)[order])
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'rows': int(len(ordinals)),
+        'cities': list(cities),
+        'source': os.path.abspath(csv_path),
+        'source_signature': list(file_signature(csv_path, use_hash=True)),
+    }
+    write_meta(meta, snapshot_dir)
+    return meta
+
+
+def write_json(data, path):
+    # Through a private temp file, so concurrent writers never share one and
+    # readers only ever see a complete file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_meta(meta, snapshot_dir=SNAPSHOT_DIR):
+    write_json(meta, os.path.join(snapshot_dir, META_FILE))
+
+
+def save_derived(name, version, arrays, snapshot_dir=SNAPSHOT_DIR):
+    path = os.path.join(snapshot_dir, name + '.npz')
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, version=np.asarray(version, dtype=np.int64), **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_derived(name, version, snapshot_dir=SNAPSHOT_DIR):
+    """The arrays saved under `name` for data `version`, or None."""
+    try:
+        with np.load(os.path.join(snapshot_dir, name + '.npz')) as data:
+            if not np.array_equal(data['version'], np.asarray(version, dtype=np.int64)):
+                return None
+            return {key: data[key] for key in data.files if key != 'version'}
+    except (FileNotFoundError, KeyError, ValueError):
+        return None
+
+
+def read_meta(snapshot_dir=SNAPSHOT_DIR):
+    meta_path = os.path.join(snapshot_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != SNAPSHOT_VERSION:
+        return None
+    return meta
+
+
+def read_source(snapshot_dir=SNAPSHOT_DIR):
+    # The CSV signature last matched by content, or None
+    try:
+        with open(os.path.join(snapshot_dir, SOURCE_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def snapshot_is_fresh(snapshot_dir=SNAPSHOT_DIR, csv_path=POLLEN_CSV):
+    meta = read_meta(snapshot_dir)
+    if meta is None:
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    mtime_ns, size, digest = meta['source_signature']
+    signature = file_signature(csv_path)
+    if signature == (mtime_ns, size):
+        return True
+    source = read_source(snapshot_dir)
+    if source is not None and source[2] == digest and signature == tuple(source[:2]):
+        return True
+    # Same size but a new mtime (checkout, copy): compare contents
+    if signature[1] != size:
+        return False
+    hashed = file_signature(csv_path, use_hash=True)
+    if hashed[2] != digest:
+        return False
+    # Record the new mtime so later checks are a stat again, not a full hash.
+    # Every racing writer records the same thing, so losing the race is fine.
+    try:
+        write_json(list(hashed), os.path.join(snapshot_dir, SOURCE_FILE))
+    except OSError:
+        pass
+    return True
+
+
+def load_snapshot(snapshot_dir=SNAPSHOT_DIR):
+    meta = read_meta(snapshot_dir)
+    if meta is None:
+        raise FileNotFoundError('no pollen snapshot in %s' % snapshot_dir)
+
+    def column(name):
+        return np.load(os.path.join(snapshot_dir, name + '.npy'), mmap_mode='r')
+
+    return PollenSnapshot(column('days'), column('day_offsets'), column('city'),
+                          column('num'), meta['cities'])
+
+
+if __name__ == '__main__':
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else POLLEN_CSV
+    snapshot_dir = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_DIR
+    meta = compile_snapshot(csv_path, snapshot_dir)
+    print('%s: %d rows, %d cities -> %s' % (csv_path, meta['rows'], len(meta['cities']), snapshot_dir))
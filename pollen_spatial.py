@@ -0,0 +1,115 @@
+#######################
+# Point-to-region lookup
+#
+# An STRtree over the prepared ADM2 regions answers "which pollen city is at
+# (x, y)" with a bounding-box search plus an exact test on the few candidate
+# polygons, instead of testing every region. The tree is built once per
+# prepared geometry and shared by all sessions.
+#
+# make_click_map() turns the map into clickable HTML for st_click_detector:
+# the map image with small transparent cells over the regions, each cell's id
+# carrying its map coordinates, which the dashboard resolves with lookup().
+import base64
+import io
+from dataclasses import dataclass
+
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+from pollen_loader import memo
+
+HISTORY_DAYS = 30
+CLICK_CELL_PX = 4
+
+
+@dataclass
+class RegionIndex():
+    tree: STRtree
+    cities: np.ndarray    # pollen city per region row
+    geo: object           # the PreparedGeometry the tree was built from
+
+    def lookup(self, x, y):
+        """Row of the region containing (x, y), or None."""
+        rows = self.tree.query(shapely.Point(x, y), predicate='intersects')
+        return int(rows.min()) if len(rows) else None
+
+    def lookup_many(self, xs, ys):
+        """Region row per point, -1 outside every region."""
+        points, rows = self.tree.query(shapely.points(xs, ys), predicate='intersects')
+        out = np.full(len(xs), -1, dtype=np.int64)
+        # Lowest row wins where shared borders match twice, as in lookup()
+        out[points[::-1]] = rows[::-1]
+        return out
+
+
+def build_region_index(geo):
+    return RegionIndex(STRtree(geo.regions.geometry.values), geo.regions['City'].to_numpy(), geo)
+
+
+def load_region_index(geo):
+    return memo('region_index', geo.key, lambda: build_region_index(geo))
+
+
+@dataclass
+class CityInfo():
+    city: str
+    name: str             # ADM2_ZH
+    day: object
+    num: float
+    history_days: np.ndarray
+    history: np.ndarray
+
+
+def city_at(store, geo, x, y, day, n_days=HISTORY_DAYS):
+    """The pollen city at (x, y) with its value on `day` and the n_days up to it."""
+    index = load_region_index(geo)
+    row = index.lookup(x, y)
+    if row is None:
+        return None
+    city = index.cities[row]
+    code = store.cities.get_loc(city)
+    days, values = store.window(day, n_days)
+    return CityInfo(city, geo.regions['ADM2_ZH'].iat[row], day, float(store.day(day)[code]),
+                    days, values[:, code])
+
+
+def make_click_map(store, geo, day, cell=CLICK_CELL_PX):
+    """HTML for st_click_detector: the day's map with coordinate-tagged cells."""
+    from PIL import Image
+
+    from pollen_playback import PlaybackMap
+
+    # The playback map has a fixed layout (no tight bbox), so its axes
+    # transform maps image pixels straight to map coordinates.
+    playback = PlaybackMap(geo)
+    try:
+        frame = playback.frame(store, day)
+        height, width = frame.shape[:2]
+        px, py = np.meshgrid(np.arange(cell / 2, width, cell), np.arange(cell / 2, height, cell))
+        px, py = px.ravel(), py.ravel()
+        # Display coordinates have their origin at the bottom left
+        xy = playback.ax.transData.inverted().transform(np.column_stack((px, height - py)))
+        rows = load_region_index(geo).lookup_many(xy[:, 0], xy[:, 1])
+        # Regions too small to contain a cell centre get one at their label
+        missing = np.setdiff1d(np.flatnonzero(~np.isnan(geo.regions['label_x'].to_numpy())), rows)
+        anchors = geo.regions[['label_x', 'label_y']].to_numpy(np.float64)[missing]
+        anchor_px = playback.ax.transData.transform(anchors).reshape(-1, 2)
+    finally:
+        playback.close()
+
+    px = np.concatenate((px, anchor_px[:, 0]))
+    py = np.concatenate((py, height - anchor_px[:, 1]))
+    xy = np.concatenate((xy, anchors))
+    hit = np.concatenate((rows >= 0, np.ones(len(anchors), dtype=bool)))
+    buf = io.BytesIO()
+    Image.fromarray(frame).convert('RGB').save(buf, format='PNG', optimize=True)
+    cells = ''.join(
+        "<a href='#' id='%.4f,%.4f' style='position:absolute;left:%.2f%%;top:%.2f%%;"
+        "width:%.2f%%;height:%.2f%%'></a>"
+        % (x, y, (left - cell / 2) * 100 / width, (top - cell / 2) * 100 / height,
+           cell * 100 / width, cell * 100 / height)
+        for (x, y), left, top in zip(xy[hit], px[hit], py[hit]))
+    return ("<div style='position:relative;width:100%%'>"
+            "<img src='data:image/png;base64,%s' style='width:100%%;display:block'>%s</div>"
+            % (base64.b64encode(buf.getvalue()).decode('ascii'), cells))
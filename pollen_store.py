@@ -0,0 +1,177 @@
+#######################
+# Date-indexed pollen store
+#
+# A dense (day x city) float32 matrix covering every calendar day between the
+# first and last observation. Row offsets are plain date arithmetic, so a day,
+# a window of days or a city's series is a numpy view of the matrix rather
+# than a boolean scan over the long-format table.
+import os
+
+import numpy as np
+import pandas as pd
+
+from pollen_loader import POLLEN_CSV, cached, file_signature, read_pollen_csv
+
+
+class PollenStore():
+
+    def __init__(self, first_day, cities, matrix, version=None):
+        # Identifies the data the store was built from (used in cache keys)
+        self.version = version
+        # Snapshot the store was loaded from, where derived tables are kept
+        self.snapshot_dir = None
+        self.first_day = np.datetime64(first_day, 'D')
+        self.cities = pd.Index(cities)
+        # matrix is a view of the first rows of _buffer; spare rows let
+        # upsert() append new days without copying the history.
+        self._buffer = matrix
+        self._set_rows(len(matrix))
+        # Days with at least one reading; calendar gaps stay all-NaN rows
+        self.observed = ~np.isnan(matrix).all(axis=1)
+
+    def _set_rows(self, n_rows):
+        self.matrix = self._buffer[:n_rows]
+        self.days = self.first_day + np.arange(n_rows)
+
+    @classmethod
+    def from_frame(cls, pollen_data):
+        pollen_data = pollen_data.dropna(subset=['Date', 'City'])
+        pollen_data = pollen_data.drop_duplicates(subset=['Date', 'City'], keep='last')
+        ordinals = pollen_data['Date'].to_numpy().astype('datetime64[D]').astype(np.int64)
+        city = pollen_data['City'].astype('category')
+        return cls._build(ordinals, city.cat.codes.to_numpy(), city.cat.categories,
+                          pollen_data['num'].to_numpy(dtype=np.float32))
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        return cls._build(snapshot.row_days.astype(np.int64), np.asarray(snapshot.city),
+                          snapshot.cities, np.asarray(snapshot.num))
+
+    @classmethod
+    def _build(cls, ordinals, codes, cities, values):
+        if len(ordinals) == 0:
+            return cls(np.datetime64('1970-01-01'), cities, np.empty((0, len(cities)), np.float32))
+        first = ordinals.min()
+        matrix = np.full((ordinals.max() - first + 1, len(cities)), np.nan, dtype=np.float32)
+        # Later rows win for duplicated (City, Date) pairs
+        matrix[ordinals - first, codes] = values
+        return cls(np.datetime64(int(first), 'D'), cities, matrix)
+
+    def city_column(self):
+        return pd.Categorical.from_codes(np.arange(len(self.cities)), dtype=pd.CategoricalDtype(self.cities))
+
+    def _offset(self, day):
+        return int((np.datetime64(day, 'D') - self.first_day).astype(np.int64))
+
+    def __contains__(self, day):
+        return 0 <= self._offset(day) < len(self.matrix)
+
+    def row(self, day):
+        offset = self._offset(day)
+        if not 0 <= offset < len(self.matrix):
+            raise KeyError(day)
+        return offset
+
+    def day_list(self):
+        # Observed days as datetime.date, newest first (for the selectbox)
+        return [d.item() for d in self.days[self.observed][::-1]]
+
+    def day(self, day):
+        """Values of every city on `day` (view)."""
+        return self.matrix[self.row(day)]
+
+    def window(self, day, n_days):
+        """The `n_days` ending at `day`: (days, values) views, clipped at the start."""
+        end = self.row(day) + 1
+        start = max(end - n_days, 0)
+        return self.days[start:end], self.matrix[start:end]
+
+    def series(self, cities, start=None, end=None):
+        """{city: values} column views, optionally limited to [start, end]."""
+        n = len(self.matrix)
+        lo = 0 if start is None else min(max(self._offset(start), 0), n)
+        hi = n if end is None else min(max(self._offset(end) + 1, lo), n)
+        return self.days[lo:hi], {city: self.matrix[lo:hi, self.cities.get_loc(city)] for city in cities}
+
+    def upsert(self, dates, cities, values):
+        """Write readings in place; returns a mask of the rows that changed anything."""
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        cities = pd.Index(cities)
+        values = np.asarray(values, dtype=np.float32)
+        if len(dates) == 0:
+            return np.zeros(0, dtype=bool)
+        new_cities = cities.unique().difference(self.cities)
+        if len(new_cities):
+            self._reshape(0, len(self.matrix), self.cities.append(new_cities))
+        offsets = (dates - self.first_day).astype(np.int64)
+        if offsets.min() < 0:
+            shift = int(-offsets.min())
+            self._reshape(shift, len(self.matrix) + shift, self.cities)
+            offsets += shift
+        if offsets.max() >= len(self.matrix):
+            self._grow(int(offsets.max()) + 1)
+        codes = self.cities.get_indexer(cities)
+
+        old = self.matrix[offsets, codes]
+        changed = ~((old == values) | (np.isnan(old) & np.isnan(values)))
+        # Later rows win for duplicated (City, Date) pairs, as in _build
+        self.matrix[offsets[changed], codes[changed]] = values[changed]
+        rows = np.unique(offsets[changed])
+        self.observed[rows] = ~np.isnan(self.matrix[rows]).all(axis=1)
+        return changed
+
+    def _grow(self, n_rows):
+        if n_rows > len(self._buffer):
+            # Double the capacity so a daily append is amortized O(1) rows
+            self._reshape(0, n_rows, self.cities, capacity=max(n_rows, 2 * len(self._buffer)))
+            return
+        n_old = len(self.matrix)
+        self._set_rows(n_rows)
+        self.observed = np.concatenate((self.observed, np.zeros(n_rows - n_old, dtype=bool)))
+
+    def _reshape(self, shift, n_rows, cities, capacity=None):
+        # Reallocate: `shift` new leading days and/or new city columns
+        buffer = np.full((capacity or n_rows, len(cities)), np.nan, dtype=np.float32)
+        n_old = len(self.matrix)
+        buffer[shift:shift + n_old, :len(self.cities)] = self.matrix
+        observed = np.zeros(n_rows, dtype=bool)
+        observed[shift:shift + n_old] = self.observed
+        self._buffer = buffer
+        self.first_day = self.first_day - np.timedelta64(shift, 'D')
+        self.cities = pd.Index(cities)
+        self._set_rows(n_rows)
+        self.observed = observed
+
+    def day_frame(self, day):
+        # Long-format rows for one day, one per city, Date NaT where missing.
+        # City is categorical over the store's own index, so the frame holds
+        # int codes instead of another copy of every name.
+        values = self.day(day)
+        dates = np.full(len(values), np.datetime64(day, 'D'), dtype='datetime64[ns]')
+        dates[np.isnan(values)] = np.datetime64('NaT')
+        return pd.DataFrame({
+            'City': self.city_column(),
+            'Date': dates,
+            'num': values,
+        })
+
+
+def load_pollen_store(path=POLLEN_CSV, snapshot_dir=None):
+    from pollen_snapshot import SNAPSHOT_DIR, META_FILE, load_snapshot, snapshot_is_fresh
+
+    snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+    from_snapshot = snapshot_is_fresh(snapshot_dir, path)
+    if from_snapshot:
+        source = os.path.join(snapshot_dir, META_FILE)
+        build = lambda: PollenStore.from_snapshot(load_snapshot(snapshot_dir))
+    else:
+        source = path
+        build = lambda: PollenStore.from_frame(read_pollen_csv(path))
+
+    def build_versioned():
+        store = build()
+        store.version = file_signature(source)
+        store.snapshot_dir = snapshot_dir if from_snapshot else None
+        return store
+
+    return cached('pollen_store', [source], build_versioned)
@@ -0,0 +1,93 @@
+#######################
+# Province overview and regional tiles
+#
+# The pollen map has two zoom levels. The overview colours the ADM1 provinces
+# by the max (or mean) of their pollen cities, using a city -> province
+# mapping precomputed from the prepared regions, so it draws the province
+# outline only. Zooming into a province switches to its regional tile: that
+# province's own prepared geometry, simplified for its extent instead of the
+# whole country, with only its ADM2 regions. Tiles are prepared, cached and
+# rendered per province.
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from pollen_loader import memo
+
+AGGREGATES = ('max', 'mean')
+# 河北省 -> 河北, 内蒙古自治区 -> 内蒙古, 香港特别行政区 -> 香港
+PROVINCE_SUFFIX = r'(省|市|壮族自治区|回族自治区|维吾尔自治区|自治区|特别行政区)$'
+
+
+@dataclass
+class ProvinceIndex():
+    codes: pd.Index             # ADM1_PCODE per outline row
+    names: np.ndarray           # short ADM1_ZH per outline row
+    label_x: np.ndarray
+    label_y: np.ndarray
+    cities: pd.Index            # store cities the mapping is aligned with
+    city_province: np.ndarray   # outline row per store city, -1 without a region
+    geo: object                 # the PreparedGeometry the index was built from
+
+    @property
+    def has_data(self):
+        """Outline rows with at least one pollen city."""
+        return np.bincount(self.city_province[self.city_province >= 0], minlength=len(self.codes)) > 0
+
+    def name(self, code):
+        return self.names[self.codes.get_loc(code)]
+
+    def aggregate(self, values, how='max'):
+        """Per-province max or mean of the member cities' values, NaN without data."""
+        known = (self.city_province >= 0) & ~np.isnan(values)
+        rows = self.city_province[known]
+        values = np.asarray(values, dtype=np.float64)[known]
+        counts = np.bincount(rows, minlength=len(self.codes))
+        if how == 'max':
+            out = np.full(len(self.codes), -np.inf)
+            np.maximum.at(out, rows, values)
+        elif how == 'mean':
+            out = np.bincount(rows, weights=values, minlength=len(self.codes)) / np.maximum(counts, 1)
+        else:
+            raise ValueError('how must be one of %s' % (AGGREGATES,))
+        out[counts == 0] = np.nan
+        return out
+
+
+def build_province_index(store, geo):
+    outline = geo.outline
+    codes = pd.Index(outline['ADM1_PCODE'])
+    anchors = outline.geometry.representative_point()
+    # A city's regions all lie in one province; first region wins otherwise
+    by_city = pd.Series(codes.get_indexer(geo.regions['ADM1_PCODE']), index=geo.regions['City'].to_numpy())
+    by_city = by_city[~by_city.index.duplicated()]
+    city_province = by_city.reindex(store.cities).fillna(-1).to_numpy(np.int64)
+    return ProvinceIndex(codes, outline['ADM1_ZH'].str.replace(PROVINCE_SUFFIX, '', regex=True).to_numpy(),
+                         anchors.x.to_numpy(np.float32), anchors.y.to_numpy(np.float32),
+                         store.cities, city_province, geo)
+
+
+def load_province_index(store, geo):
+    return memo('province_index', (store.version, geo.key), lambda: build_province_index(store, geo))
+
+
+def load_tile_geometry(store, province):
+    from pollen_charts import MAP_FIGSIZE
+    from pollen_geometry import load_prepared_geometry
+    from pollen_render_cache import RENDER_DPI
+
+    return load_prepared_geometry(store.cities, figsize=MAP_FIGSIZE, dpi=RENDER_DPI, province=province)
+
+
+def build_overview_map(store, geo, day, how='max'):
+    from pollen_charts import make_province_map
+
+    index = load_province_index(store, geo)
+    return make_province_map(index.aggregate(store.day(day), how), geo, index, day)
+
+
+def build_tile_map(store, province, day):
+    from pollen_charts import make_pollen_map
+
+    return make_pollen_map(store.day_frame(day), load_tile_geometry(store, province), day)
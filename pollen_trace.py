@@ -0,0 +1,117 @@
+#######################
+# Stage timings
+#
+# A lightweight tracer for the load and render pipeline. Stages are timed with
+# `span()` blocks or the `traced()` decorator and kept in a process-wide ring
+# buffer (the last TRACE_BUFFER spans), summarized as p50/p95 per stage and
+# exported as JSON lines for offline analysis. Set POLLEN_TRACE_FILE to also
+# append every span to that file as it finishes. process_memory() reports the
+# process's resident memory, which the dashboard records with every rerun.
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from functools import wraps
+
+import numpy as np
+
+TRACE_BUFFER = 4096
+TRACE_FILE = os.environ.get('POLLEN_TRACE_FILE')
+
+
+@dataclass
+class Span():
+    stage: str
+    start: float       # wall clock, seconds since the epoch
+    seconds: float
+    thread: str
+    meta: dict = field(default_factory=dict)
+
+
+class Tracer():
+
+    def __init__(self, maxlen=TRACE_BUFFER, path=TRACE_FILE):
+        self._spans = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self.path = path
+
+    def record(self, stage, start, seconds, **meta):
+        span = Span(stage, start, seconds, threading.current_thread().name, meta)
+        with self._lock:
+            self._spans.append(span)
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(asdict(span), ensure_ascii=False, default=str) + '\n')
+        return span
+
+    @contextmanager
+    def span(self, stage, **meta):
+        start = time.time()
+        t0 = time.perf_counter()
+        try:
+            yield meta
+        finally:
+            self.record(stage, start, time.perf_counter() - t0, **meta)
+
+    def traced(self, stage=None):
+        """Decorator timing every call of a function as `stage` (default: its name)."""
+        def decorate(func):
+            name = stage or func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    def stage_stats(self):
+        """{stage: (count, p50 ms, p95 ms, max ms)} over the buffered spans."""
+        by_stage = {}
+        for span in self.spans():
+            by_stage.setdefault(span.stage, []).append(span.seconds)
+        stats = {}
+        for stage, seconds in sorted(by_stage.items()):
+            ms = np.asarray(seconds) * 1000
+            p50, p95 = np.percentile(ms, [50, 95])
+            stats[stage] = (len(ms), p50, p95, ms.max())
+        return stats
+
+    def to_jsonl(self):
+        return ''.join(json.dumps(asdict(span), ensure_ascii=False, default=str) + '\n'
+                       for span in self.spans())
+
+
+def process_memory():
+    """(current, peak) resident set size of this process in bytes, None where unknown."""
+    current = peak = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return current, peak
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return current, max(peak, current or 0)
+
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
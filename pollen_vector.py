@@ -0,0 +1,104 @@
+#######################
+# Vector (Altair) render backend
+#
+# The prepared geometry is exported once per process as GeoJSON under
+# static/, which Streamlit serves as plain files (server.enableStaticServing).
+# The browser fetches it by URL and caches it, so a day change only ships the
+# chart spec and the per-city values, which Vega joins onto the shapes with a
+# lookup transform. File names carry a content hash, so a new geometry never
+# collides with a cached old one.
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from pollen_charts import compare_colors
+from pollen_loader import CHINA_SHP, cached
+from pollen_trace import traced
+
+STATIC_DIR = 'static'
+STATIC_URL = 'app/static/'
+# Coordinate grid for the exported shapes, below half a pixel on the map
+GRID_SIZE = 0.01
+
+
+def _altair():
+    # Only the vector path pays for importing altair; the dashboard's dark
+    # theme is enabled with it, once per process.
+    import altair as alt
+
+    if alt.themes.active != 'dark':
+        alt.themes.enable('dark')
+    return alt
+
+
+def _write_geojson(gdf, prefix):
+    gdf = gdf.copy()
+    gdf['geometry'] = shapely.set_precision(gdf.geometry.values, GRID_SIZE)
+    text = gdf.to_json(drop_id=True)
+    name = '%s_%s.json' % (prefix, hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest())
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(path):
+        os.makedirs(STATIC_DIR, exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(path + '.tmp', path)
+    return STATIC_URL + name
+
+
+def export_geometry(geo):
+    """URLs of the region and outline GeoJSON for `geo`, written once per process."""
+    def build():
+        return (_write_geojson(geo.regions[['City', 'ADM2_ZH', 'geometry']], 'pollen_regions'),
+                _write_geojson(geo.outline[['ADM1_ZH', 'geometry']], 'pollen_outline'))
+
+    name = 'vector_geometry:' + repr((geo.figsize, geo.dpi, tuple(geo.join.cities)))
+    return cached(name, [CHINA_SHP], build)
+
+
+@traced()
+def make_vector_map(input_df, input_geo):
+    alt = _altair()
+
+    regions_url, outline_url = export_geometry(input_geo)
+    features = alt.DataFormat(property='features', type='json')
+    # Only this small table changes from day to day
+    values = pd.DataFrame({'City': input_df['City'].astype(str), 'num': input_df['num']}).dropna()
+    labels = input_geo.regions.loc[input_geo.regions.City.isin(values.City), ['label_x', 'label_y', 'ADM2_ZH']]
+    labels = labels.assign(ADM2_ZH=labels.ADM2_ZH.str[:5])
+
+    outline = alt.Chart(alt.Data(url=outline_url, format=features)).mark_geoshape(
+        fill='lightgrey', stroke='grey', strokeWidth=0.3)
+    regions = alt.Chart(alt.Data(url=regions_url, format=features)).mark_geoshape(
+        stroke='grey', strokeWidth=0.3).transform_lookup(
+        lookup='properties.City', from_=alt.LookupData(values, 'City', ['num'])
+    ).encode(
+        color=alt.Color('num:Q', title='花粉指数',
+                        scale=alt.Scale(scheme='blueorange', domain=[0, 3000]),
+                        legend=None),
+        tooltip=[alt.Tooltip('properties.ADM2_ZH:N', title='城市'),
+                 alt.Tooltip('num:Q', title='花粉指数', format='d')])
+    text = alt.Chart(labels).mark_text(fontSize=7, color='black').encode(
+        longitude='label_x:Q', latitude='label_y:Q', text='ADM2_ZH:N')
+    return alt.layer(outline, regions, text).project(type='equirectangular').properties(height=400)
+
+
+@traced()
+def make_vector_chart(input_store, cities, labels, start=None, end=None):
+    alt = _altair()
+
+    line_days, pollen_line = input_store.series(cities, start, end)
+    data = pd.DataFrame({
+        'Date': np.tile(line_days, len(cities)),
+        'City': np.repeat([labels.get(city, city) for city in cities], len(line_days)),
+        'num': np.concatenate([pollen_line[city] for city in cities] or [np.empty(0, np.float32)]),
+    })
+    return alt.Chart(data).mark_line(point=True, strokeDash=[2, 2]).encode(
+        x=alt.X('Date:T', title=None),
+        y=alt.Y('num:Q', title='花粉指数'),
+        color=alt.Color('City:N', title=None, sort=[labels.get(city, city) for city in cities],
+                        scale=alt.Scale(range=compare_colors)),
+        tooltip=['City:N', alt.Tooltip('Date:T', format='%Y-%m-%d'), alt.Tooltip('num:Q', format='d')],
+    ).properties(height=400)
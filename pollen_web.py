@@ -1,20 +1,23 @@
 #######################
 # Import libraries
+import datetime
+import time
 import streamlit as st
-import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import matplotlib as mpl
-from matplotlib.pyplot import MultipleLocator
-from matplotlib.dates import DateFormatter
-import matplotlib.dates as mdates
-import altair as alt
-import plotly.express as px
-from datetime import datetime, date, time, timedelta
 from st_click_detector import click_detector
-import numpy as np
-from dataclasses import dataclass
+from pollen_charts import columnA, columnB, labelA, labelB, make_chart, make_city_labels, make_full_aqi_charts, make_full_weather_charts, make_pollen_map
+from pollen_aggregates import load_aggregates
+from pollen_forecast import forecast, forecast_frame, load_forecast
+from pollen_prerender import load_day_chart, load_map_geometry
+from pollen_loader import cache_stats
+from pollen_store import load_pollen_store
+from pollen_render_cache import figure_cache
+from pollen_panels import load_aqi_panel, load_weather_panel, panel_version
+from pollen_trace import process_memory, span, tracer
+# altair (vector backend), the playback module, the click map (shapely) and
+# the map tiles are imported on first use
+
+rerun_start = time.time()
+rerun_t0 = time.perf_counter()
 
 #######################
 # Page configuration
@@ -24,22 +27,16 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded")
 
-alt.themes.enable("dark")
-
-# China font simhei added to show chinese characters
-mpl.font_manager.fontManager.addfont('font/SimHei.ttf') #临时注册新的全局字体
-plt.rcParams['font.sans-serif']=['SimHei'] #用来正常显示中文标签
-plt.rcParams['axes.unicode_minus']=False#用来正常显示负号
-
 #######################
-# Load data
-pollen_data = pd.read_csv('data/pollen_optimize.csv')
-pollen_data = pollen_data.loc[:, ['Date', 'num', 'City']]
-pollen_data['Date'] = pd.to_datetime(pollen_data['Date'], 'coerce')
-china_map = gpd.read_file('data/chn_admbnda_adm2_ocha_2020.shp')
-china_map.loc[china_map.ADM2_ZH == "西安市", 'ADM2_EN'] = 'Xian'
+# Load data (shared by all sessions, reloaded only when the files change)
+with span('load'):
+    pollen_store = load_pollen_store()
 
-pollen_city = pd.DataFrame((ct for ct in list(pollen_data.City.unique())), columns=('City',))
+    # Simplified regions and province outline sized for the map figure
+    china_geo = load_map_geometry(pollen_store)
+    # Per-day rankings, risk-tier counts and rolling stats, built once per data version
+    pollen_aggregates = load_aggregates(pollen_store)
+    city_labels = {**make_city_labels(china_geo.regions), columnA: labelA, columnB: labelB}
 
 #######################
 # Sidebar
@@ -51,22 +48,51 @@ with st.sidebar:
     
 
     # Select a day box
-    day_list = [dt.date() for dt in list(pollen_data.Date.unique())]
-    day_list.sort(reverse=True)
+    day_list = pollen_store.day_list()
     max_day = day_list[0]
     min_day = day_list[-1]
     st.markdown("---")
     st.markdown("### Select a day:")
     selected_day = st.selectbox(' days list', day_list)
-    tm = time(0,0,0)
-    selected_datetime = datetime.combine(selected_day, tm)
-    selected_lower_datetime = selected_datetime - timedelta(days=9)
-    pollen_day = pollen_data[pollen_data.Date == selected_datetime]
-    pollen_day = pollen_city.merge(pollen_day, on='City', how='left')
-    pollen_heatmap = pollen_data[pollen_data.Date.between(selected_lower_datetime, selected_datetime)]
-    pollen_heatmap['Date'] = pollen_heatmap.Date.dt.strftime('%y-%m-%d')
-    
-    pollen_day_sorted = pollen_day.sort_values(by="num", ascending=False)[ : 10]
+    pollen_day = pollen_store.day_frame(selected_day)
+    pollen_day['mean7'] = pollen_aggregates.rolling_mean(selected_day, 7)
+    pollen_day['mean30'] = pollen_aggregates.rolling_mean(selected_day, 30)
+
+    # Cities and date range for the comparison chart
+    st.markdown("---")
+    st.markdown("### 对比城市:")
+    compare_cities = st.multiselect(' cities', list(pollen_store.cities), default=[columnA, columnB],
+                                    format_func=lambda city: city_labels.get(city, city))
+    compare_range = st.slider(' date range', min_value=min_day, max_value=max_day,
+                              value=(min_day, max_day), format='YYYY-MM-DD')
+
+    # Vector charts ship the geometry once and then only per-day values
+    st.markdown("---")
+    render_backend = st.radio('图表渲染', ['图片', '矢量'], horizontal=True)
+    # Animate the map over a recent range; long ranges are strided to a frame cap
+    playback = st.toggle('播放地图')
+    if playback:
+        from pollen_playback import PLAYBACK_DEFAULT_DAYS, PLAYBACK_MAX_FRAMES, playback_stride
+        playback_start = max(min_day, max_day - datetime.timedelta(days=PLAYBACK_DEFAULT_DAYS - 1))
+        playback_range = st.slider(' playback range', min_value=min_day, max_value=max_day,
+                                   value=(playback_start, max_day), format='YYYY-MM-DD')
+        playback_stride_days = playback_stride(sum(playback_range[0] <= day <= playback_range[1]
+                                                   for day in day_list))
+        if playback_stride_days > 1:
+            st.warning('超过 %d 帧, 每 %d 天播放一帧' % (PLAYBACK_MAX_FRAMES, playback_stride_days))
+    # Image map level: province overview, all cities, or one province's tile
+    from pollen_tiles import load_province_index
+    province_index = load_province_index(pollen_store, china_geo)
+    map_views = ['provinces', 'national'] + list(province_index.codes[province_index.has_data])
+    map_view_labels = {'provinces': '全国 (省级)', 'national': '全国 (城市)'}
+    map_view = st.selectbox('地图范围', map_views,
+                            format_func=lambda view: map_view_labels.get(view) or province_index.name(view))
+    if map_view == 'provinces':
+        province_aggregate = st.radio('省级汇总', ['max', 'mean'], horizontal=True,
+                                      format_func={'max': '最大值', 'mean': '平均值'}.get)
+    # Next days from the per-city forecast models (see pollen_forecast.py)
+    show_forecast = st.toggle('显示预测')
+    pollen_forecast = forecast(load_forecast(pollen_store), pollen_store) if show_forecast else None
     
     # Dynamic Color Pickers
     st.markdown("---")
@@ -92,396 +118,34 @@ with st.sidebar:
         color_clicked = "blues"
 
     # color_clicked = "blues"
-    
-#######################
-# Plots
-######################
-# Global Value
-columnA = 'Beijing Municipality'
-columnB = 'Chengde'
-labelA = '北京'
-labelB = '承德'
-# Chart
-def make_chart(input_df):
-    data_set = input_df.loc[pollen_data.City.isin([columnA, columnB])]
-    pollen_line = data_set.pivot(index='Date', columns='City', values='num')
-    pollen_line = pollen_line.sort_index()
-    min_date = pollen_line.index.min()
-    max_date = pollen_line.index.max()
-    ############################
-    # Init
-    fig, ax = plt.subplots(figsize=(12,8))
-    # ax.xaxis.set_major_locator(mdates.DayLocator(interval=7))
-    # ax.xaxis.set_minor_locator(mdates.DayLocator())
-    # ax.xaxis.set_major_formatter(DateFormatter("%m-%d"))
-    
-    locator = mdates.AutoDateLocator(minticks=11, maxticks=21)
-    formatter = mdates.ConciseDateFormatter(locator)
-    formatter.formats = ['%y',  # ticks are mostly years
-                         '%y-%m',       # ticks are mostly months
-                         '%d',       # ticks are mostly days
-                         '%H:%M',    # hrs
-                         '%H:%M',    # min
-                         '%S.%f', ]  # secs
-    # these are mostly just the level above...
-    formatter.zero_formats = [''] + formatter.formats[:-1]
-    # ...except for ticks that are mostly hours, then it is nice to have
-    # month-day:
-    formatter.zero_formats[3] = '%m-%d'
-
-    formatter.offset_formats = ['',
-                                '%Y',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d %H:%M', ]
-    ax.xaxis.set_major_locator(locator)
-    ax.xaxis.set_major_formatter(formatter)
-      
-    ax.grid(True)
-    ax.grid(which='major', color='#DDDDDD', linewidth=0.9)
-    ax.grid(which='minor', color='#CCCCCC', linestyle=':', linewidth=0.8)
-    ax.minorticks_on()
-
-    # Set title
-    ax.set_title('花粉指数: 北京 ：承德')
-    # Set the limits for the Y axis
-    ax.set_ylim([-100, 2100])
-    # ax.set_xlim([0, 100])
-    ax.set_xlim(np.array([min_date, max_date]).astype('datetime64[D]'))
-  
-    chartA, = ax.plot(np.array(list(pollen_line.index)).astype('datetime64[D]'), list(pollen_line[columnA]), marker='o', color= '#00A88F', linestyle='dotted', label=labelA)
-    chartB, = ax.plot(np.array(list(pollen_line.index)).astype('datetime64[D]'), list(pollen_line[columnB]), marker='+', color= '#884b8f', linestyle='dotted', label=labelB)    
-    legend = ax.legend(loc='upper left', shadow=False, fontsize='medium')
-    legend.get_frame().set_facecolor('None')
-    return fig
-
-# Pollen Map
-def make_pollen_map(input_df, input_gdf, input_date):
-    # Drawing map with matplotlib
-    fig, ax = plt.subplots(1, 
-                           figsize = (6, 4))
-    # Clear the axes each iteration
-    ax.clear()
-    fig.set_facecolor('none')
-    
-    # Filter data based on current date
-    current_data = input_df
-    
-    # Merge the data with the world dataframe
-    map_for_date = input_gdf.merge(current_data, how='left', left_on='ADM2_EN', right_on='City')
-    
-    map_match_data = input_gdf.merge(current_data, how='inner', left_on='ADM2_EN', right_on='City')
-    
-    # Parameters for missing values
-    missing_kwds = {
-        "color"    : "white",
-        "edgecolor": "lightgrey",
-        "hatch"    : "///", 
-        "label"    : "缺失值"
-    }
-    
-    classification_kwds = {
-        'bins': [50, 100, 300, 500, 800, 9999]
-        }
-
-    legend_kwds = {
-        'loc': 'lower right', 
-        'prop': {'size': 7 },
-        'title': '花粉过敏指数', 
-        "edgecolor": "grey",
-        'fontsize': '5',
-        'title_fontsize': '8',
-        'shadow': True
-        }
-    
-    # Create a custom colormap
-    # colors_list = color_breaks
-    # cmap_name   = "default_cmap"
-    # cmap        = (colors
-    #                .LinearSegmentedColormap
-    #                .from_list(cmap_name, colors_list))
-
-    map_for_date.plot(column='num', cmap='coolwarm', linewidth=0.1, ax=ax, edgecolor='grey',
-                      legend=False, vmin=0, vmax=3000, missing_kwds={'color': 'lightgrey', 'hatch': '///'})
-    # map_for_date.plot(ax=ax, 
-    #                   column='num',     
-    #                   edgecolor    = "grey",                         
-    #                 #   cmap         = cmap,
-    #                   cmap         = 'Reds',
-    #                   linewidth    = 0.5,
-    #                   legend       = True,
-    #                   missing_kwds = missing_kwds,
-    #                   scheme       = 'UserDefined',
-    #                   classification_kwds = classification_kwds,
-    #                   legend_kwds  = legend_kwds
-    #                  )
-    
-    for idx, _ in enumerate(map_match_data.geometry.representative_point()):
-        region = map_match_data.loc[idx, 'ADM2_ZH'][:5]
-        ax.text(_.x, _.y, region, ha="center", va="center", size=4)
-    
-    #Title, lines and annotations
-    # ax.set_title('Tracking Pollen Index', fontsize=25, pad=30, weight='bold')
-    # ax.axhline(y=0.5, color='black', linestyle='--', alpha=0.2) # Horizontal line 
-    
-    # date_pd = pd.to_datetime(str(input_date))
-    # # date_formatted = date_pd.strftime('%B %d %Y')
-    # date_formatted = date_pd.strftime('%Y %m %d')
-    
-    # # ax.annotate("Pollen Allergy Index On " + date_formatted,xy=(0.5,0), xytext=(0,0), 
-    #                 #    xycoords='axes fraction', textcoords='offset points', ha='center', fontsize=14, 
-    #                 #    color='grey', weight='bold')
-    # ax.annotate("花粉过敏指数： " + date_formatted,xy=(0.5,0), xytext=(0,0), 
-    #                    xycoords='axes fraction', textcoords='offset points', ha='center', fontsize=14, 
-    #                    color='grey', weight='bold')
-   
-    # ax.annotate('Equatorial Line',xy=(0.9,0.43), xytext=(0,0), 
-    #                    xycoords='axes fraction', textcoords='offset points', ha='center', fontsize=7, 
-    #                    color='black', weight='bold')
-    
-    # Turn off the axes
-    # ax.xaxis.set_visible(False)
-    # ax.yaxis.set_visible(False)
-    ax.axis('off')
-    return fig
-    
-def make_bar(names, values, label, x, y):
-    # Figure Size
-    fig, ax = plt.subplots(figsize =(x, y))
-    
-    # Horizontal Bar Plot
-    color = 'lightblue'
-    ax.barh(names, values, color=color)
-    
-    # Remove axes splines
-    for s in ['top', 'bottom', 'left', 'right']:
-        ax.spines[s].set_visible(False)
-    
-    # Remove x, y Ticks
-    ax.xaxis.set_ticks_position('none')
-    ax.yaxis.set_ticks_position('none')
-    
-    # Add padding between axes and labels
-    ax.xaxis.set_tick_params(pad = 5)
-    ax.yaxis.set_tick_params(pad = 10)
-    
-    # Add x, y gridlines
-    ax.grid(visible = True, color ='grey',
-            linestyle ='-.', linewidth = 0.5,
-            alpha = 0.2)
-    
-    ax.invert_yaxis()
-    
-    # Add annotation to bars
-    for i in ax.patches:
-        plt.text(i.get_width()+0.2, i.get_y()+0.5, 
-                str(round((i.get_width()), 2)),
-                fontsize = 10, fontweight ='bold',
-                color ='lightblue')
-    
-    # Add Plot Title
-    # ax.set_title(label, loc ='left', )
-    
-    # Add Text watermark
-    fig.text(0.9, 0.15, 'robertyu', fontsize = 12,
-            color ='grey', ha ='right', va ='bottom',
-            alpha = 0.7)
-    
-    return fig
-
-    
-@dataclass
-class DataLine():
-    xlist: np.array
-    ylist: np.array
-    annotation: np.array
-    label: str
 
-def get_aqi_data(df, column_t, column_a, label_t, label_a):
-    times = [i.replace(tzinfo=None) for i in list(pd.to_datetime(df['time']))]
-    tempe_data = DataLine(times, df[column_t], [], label_t)
-    aqi_data = DataLine(times, df[column_a], [], label_a)
-    
-    return tempe_data, aqi_data    
-
-def get_weather_data(df, column_high, column_low, column_annotation, label_high, label_low):
-    times = [i.replace(tzinfo=None) for i in list(pd.to_datetime(df['日期']))]
-    high_data = DataLine(times, df[column_high], df[column_annotation], label_high)
-    low_data = DataLine(times, df[column_low], df[column_annotation], label_low)
-    
-    return high_data, low_data    
-        
-def make_aqi_charts(ax, datas: list[DataLine], markers: list[str], colors: list[str], title: str):
-
-    ############################
-    # Init
-    
-    locator = mdates.AutoDateLocator(minticks=5, maxticks=11)
-    formatter = mdates.ConciseDateFormatter(locator)
-    formatter.formats = ['%y',  # ticks are mostly years
-                         '%y-%m',       # ticks are mostly months
-                         '%d',       # ticks are mostly days
-                         '%H:%M',    # hrs
-                         '%H:%M',    # min
-                         '%S.%f', ]  # secs
-    # these are mostly just the level above...
-    formatter.zero_formats = [''] + formatter.formats[:-1]
-    # ...except for ticks that are mostly hours, then it is nice to have
-    # month-day:
-    formatter.zero_formats[3] = '%m-%d'
-
-    formatter.offset_formats = ['',
-                                '%Y',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d %H:%M', ]
-    ax.xaxis.set_major_locator(locator)
-    ax.xaxis.set_major_formatter(formatter)
-      
-    ax.grid(True)
-    ax.grid(which='major', color='#DDDDDD', linewidth=0.9)
-    ax.grid(which='minor', color='#CCCCCC', linestyle=':', linewidth=0.8)
-    ax.minorticks_on()
-
-    # Set title
-    ax.set_title(title)
-    
-    xmin = np.min(datas[0].xlist)
-    xmax = np.max(datas[0].xlist)
-    ymin = np.min(9999)
-    ymax = np.max(-9999)
-    
-    charts = []
-    i = 0
-    for data in datas:
-        chart = ax.plot(data.xlist, data.ylist, marker=markers[i], color= colors[i], linestyle='dotted', label=data.label)
-        charts.append(chart)
-        i += 1
-        if ymin > np.min(data.ylist):
-            ymin = np.min(data.ylist)
-        if ymax < np.max(data.ylist):
-            ymax = np.max(data.ylist)
-
-    # Set the limits for the X，Y axis
-    margin = abs(ymin // 5)
-    if abs(ymax // 5) > margin:
-        margin = abs(ymax // 5)
-    ax.set_ylim([ymin - margin, ymax + margin])
-    ax.set_xlim([xmin, xmax])
-    # ax.xaxis.axis_date(tz='Asia/Shanghai')
-    legend = ax.legend(loc='upper left', shadow=False, fontsize='medium')
-    legend.get_frame().set_facecolor('None')
-
-    # for i in range(25):
-    #     ax.annotate(i, xy=(datas[0].xlist[i], datas[0].ylist[i]))    
-    return charts
-
-def make_weather_charts(ax, datas: list[DataLine], markers: list[str], colors: list[str], title: str):
-
-    ############################
-    # Init
-    
-    locator = mdates.AutoDateLocator(minticks=5, maxticks=11)
-    formatter = mdates.ConciseDateFormatter(locator)
-    formatter.formats = ['%y',  # ticks are mostly years
-                         '%y-%m',       # ticks are mostly months
-                         '%d',       # ticks are mostly days
-                         '%H:%M',    # hrs
-                         '%H:%M',    # min
-                         '%S.%f', ]  # secs
-    # these are mostly just the level above...
-    formatter.zero_formats = [''] + formatter.formats[:-1]
-    # ...except for ticks that are mostly hours, then it is nice to have
-    # month-day:
-    formatter.zero_formats[3] = '%m-%d'
-
-    formatter.offset_formats = ['',
-                                '%Y',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d',
-                                '%Y-%m-%d %H:%M', ]
-    ax.xaxis.set_major_locator(locator)
-    ax.xaxis.set_major_formatter(formatter)
-      
-    ax.grid(True)
-    ax.grid(which='major', color='#DDDDDD', linewidth=0.9)
-    ax.grid(which='minor', color='#CCCCCC', linestyle=':', linewidth=0.8)
-    ax.minorticks_on()
-
-    # Set title
-    ax.set_title(title)
-    
-    xmin = np.min(datas[0].xlist)
-    xmax = np.max(datas[0].xlist)
-    ymin = np.min(9999)
-    ymax = np.max(-9999)
-    
-    charts = []
-    i = 0
-    for data in datas:
-        chart = ax.plot(data.xlist, data.ylist, marker=markers[i], color= colors[i], linestyle='dotted', label=data.label)
-        charts.append(chart)
-        i += 1
-        if ymin > np.min(data.ylist):
-            ymin = np.min(data.ylist)
-        if ymax < np.max(data.ylist):
-            ymax = np.max(data.ylist)
-
-    # Set the limits for the X，Y axis
-    margin = abs(ymin // 5)
-    if abs(ymax // 5) > margin:
-        margin = abs(ymax // 5)
-    ax.set_ylim([ymin - margin, ymax + margin])
-    ax.set_xlim([xmin, xmax])
-    # ax.xaxis.axis_date(tz='Asia/Shanghai')
-    legend = ax.legend(loc='upper left', shadow=False, fontsize='medium')
-    legend.get_frame().set_facecolor('None')
-    print(datas[0])
-    for i in range(len(datas[0].annotation)):
-        ax.annotate(datas[0].annotation[i], xy=(datas[0].xlist[i], datas[0].ylist[i] + 1), fontsize=5)    
-    return charts
-
-
-def make_full_aqi_charts():
-#     dfA, dfB = get_aqi_df(dr)
-    dfA = pd.read_csv('data/aqi_beijing.csv')
-    dfB = pd.read_csv('data/aqi_chifeng.csv')
-    
-    dataA_t, dataA_a = get_aqi_data(dfA, "beijing_t", "beijing_a", "北京温度", '北京空气质量')
-    dataB_t, dataB_a = get_aqi_data(dfB, "chifeng_t", "chifeng_a", "赤峰温度", '赤峰空气质量')
-
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12,4))
-    
-    make_aqi_charts(ax1, [dataA_t, dataB_t], ['o', 'x'], ['#00A88F', '#884b8f'], '温度 北京 - 赤峰')
-    make_aqi_charts(ax2, [dataA_a, dataB_a], ['o', 'x'], ['#00A88F', '#884b8f'], '空气质量 北京 - 赤峰')
-
-    # plt.gca().xaxis_date('Asia/Shanghai')
-    # plt.show()
-    return fig
-
-def make_full_weather_charts():
-#     dfA, dfB = get_aqi_df(dr)
-    dfA = pd.read_csv('data/weather_beijing.csv')
-    dfB = pd.read_csv('data/weather_chifeng.csv')
-    
-    dataA_t, dataA_a = get_weather_data(dfA, "最高气温", "最低气温", "天气", "北京最高温度", '北京最低温度')
-    dataB_t, dataB_a = get_weather_data(dfB, "最高气温", "最低气温", "天气", "赤峰最高温度", '赤峰最低温度')
-
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12,4))
+    # Stage timings of recent reruns in this process (see pollen_trace.py)
+    st.markdown("---")
+    if st.checkbox('性能统计'):
+        stage_stats = tracer.stage_stats()
+        st.dataframe({'stage': list(stage_stats),
+                      'n': [s[0] for s in stage_stats.values()],
+                      'p50 ms': [round(s[1], 1) for s in stage_stats.values()],
+                      'p95 ms': [round(s[2], 1) for s in stage_stats.values()],
+                      'max ms': [round(s[3], 1) for s in stage_stats.values()]},
+                     hide_index=True)
+        st.download_button('导出 JSON lines', tracer.to_jsonl(), file_name='pollen_trace.jsonl',
+                           mime='application/x-ndjson')
+        # Data and images are shared by every session in this process
+        rss, peak_rss = process_memory()
+        image_cache = figure_cache.stats()
+        size = lambda n: ('-' if n is None else '%.1f MiB' % (n / 2 ** 20) if n >= 2 ** 20
+                          else '%.1f KiB' % (n / 2 ** 10))
+        st.caption('进程内存 %s (峰值 %s)' % (size(rss), size(peak_rss)))
+        st.caption('花粉矩阵 %s, 图片缓存 %s / %d 张' % (size(pollen_store.matrix.nbytes), size(image_cache.nbytes),
+                                                image_cache.entries))
+        # Hit/miss counts of the process-wide data cache (see pollen_loader.py)
+        data_cache = cache_stats()
+        st.dataframe({'cache': list(data_cache),
+                      'hits': [s.hits for s in data_cache.values()],
+                      'misses': [s.misses for s in data_cache.values()]},
+                     hide_index=True)
     
-    make_weather_charts(ax1, [dataA_t, dataA_a], ['o', 'x'], ['#00A88F', '#884b8f'], '北京未来15天天气预报')
-    make_weather_charts(ax2, [dataB_t, dataB_a], ['o', 'x'], ['#00A88F', '#884b8f'], '赤峰未来15天天气预报')
-
-    # plt.gca().xaxis_date('Asia/Shanghai')
-    # plt.show()
-    return fig
-
-
-
-        
 #######################
 # Dashboard Main Panel
 st.markdown('#### 城市天气指数数据')
@@ -490,13 +154,75 @@ col = st.columns((6, 5), gap='small')
 
 with col[0]:
     st.markdown('##### 城市花粉指数')    
-    pollenplt = make_pollen_map(pollen_day, china_map, selected_day)
-    st.pyplot(pollenplt, use_container_width=True)    
+    # Charts are served from the PNG cache, keyed by their real inputs;
+    # day charts come from the pre-rendered image store when it is current.
+    with span('section:map'):
+        if playback:
+            from pollen_playback import make_playback_gif
+            with st.spinner('生成动画...'):
+                gif = figure_cache.render(('playback', playback_range, pollen_store.version),
+                                          make_playback_gif, pollen_store, china_geo, *playback_range)
+            st.image(gif, use_column_width=True)
+        elif render_backend == '矢量':
+            from pollen_vector import make_vector_map
+            st.altair_chart(make_vector_map(pollen_day, china_geo), use_container_width=True)
+        elif map_view == 'provinces':
+            from pollen_tiles import build_overview_map
+            pollenplt = figure_cache.render(('province_map', selected_day, province_aggregate, pollen_store.version),
+                                            build_overview_map, pollen_store, china_geo, selected_day,
+                                            province_aggregate)
+            st.image(pollenplt, use_column_width=True)
+        elif map_view == 'national':
+            pollenplt = figure_cache.render(('pollen_map', selected_day, pollen_store.version),
+                                            load_day_chart, 'map', pollen_store, china_geo, selected_day)
+            st.image(pollenplt, use_column_width=True)    
+        else:
+            from pollen_tiles import build_tile_map
+            pollenplt = figure_cache.render(('tile', map_view, selected_day, pollen_store.version),
+                                            build_tile_map, pollen_store, map_view, selected_day)
+            st.image(pollenplt, use_column_width=True)
+        if show_forecast:
+            forecast_days, forecast_values = pollen_forecast
+            tabs = st.tabs(['预测 %s' % day for day in forecast_days])
+            for i, (tab, day) in enumerate(zip(tabs, forecast_days)):
+                png = figure_cache.render(('forecast_map', i, pollen_store.version), make_pollen_map,
+                                          forecast_frame(pollen_store, forecast_values, i), china_geo, day)
+                tab.image(png, use_column_width=True)
 
 with col[1]:  
     st.markdown('##### 城市花粉指数对比')    
-    fig = make_chart(pollen_data)
-    st.pyplot(fig, use_container_width=True)
+    with span('section:chart'):
+        if render_backend == '矢量':
+            from pollen_vector import make_vector_chart
+            st.altair_chart(make_vector_chart(pollen_store, compare_cities, city_labels, *compare_range),
+                            use_container_width=True)
+        else:
+            fig = figure_cache.render(('chart', tuple(compare_cities), compare_range, show_forecast,
+                                       pollen_store.version),
+                                      make_chart, pollen_store, compare_cities, city_labels, *compare_range,
+                                      forecast=pollen_forecast)
+            st.image(fig, use_column_width=True)
+
+# Click a region to see its city, today's value and recent history; an
+# expander would build the click map on every rerun, even while collapsed
+if st.toggle('点击地图查询城市'):
+    from pollen_spatial import city_at, make_click_map
+    col = st.columns((6, 5), gap='small')
+    with col[0]:
+        click_map = figure_cache.render(('click_map', selected_day, pollen_store.version),
+                                        lambda: make_click_map(pollen_store, china_geo, selected_day).encode())
+        clicked = click_detector(click_map.decode(), key='city_click')
+    with col[1]:
+        info = None
+        if clicked:
+            x, y = map(float, clicked.split(','))
+            info = city_at(pollen_store, china_geo, x, y, selected_day)
+        if info is None:
+            st.caption('点击地图上的城市')
+        else:
+            st.metric(info.name, '-' if info.num != info.num else '%d' % info.num)
+            st.line_chart({'花粉指数': info.history}, height=200)
+            st.caption('%s ~ %s' % (info.history_days[0], info.history_days[-1]))
 
 col = st.columns((2, 2, 1), gap='medium')    
 with col[0]:
@@ -517,6 +243,14 @@ with col[0]:
                         "日期",
                         format="YYYY-MM-DD",
                     ),
+                    "mean7": st.column_config.NumberColumn(
+                        "7日均值",
+                        format="%d",
+                    ),
+                    "mean30": st.column_config.NumberColumn(
+                        "30日均值",
+                        format="%d",
+                    ),
                 },
                 hide_index=True
     )
@@ -530,11 +264,10 @@ with col[0]:
 with col[1]:
     st.markdown('#### 花粉最多十城市')
 
-    cities = pollen_day_sorted['City']
-    values = pollen_day_sorted['num']
-    label  = '花粉最多十城市'
-    fig = make_bar(cities, values, label, 5, 5)
-    st.pyplot(fig)
+    with span('section:bar'):
+        fig = figure_cache.render(('bar', selected_day, pollen_store.version),
+                                  load_day_chart, 'bar', pollen_store, china_geo, selected_day)
+        st.image(fig)
 
 with col[2]:        
     with st.expander('花粉指数', expanded=True):
@@ -547,10 +280,17 @@ with col[2]:
             - 很低（<=50）：不易过敏
             ''')
 
+    st.markdown('#### 风险等级城市数')
+    st.dataframe(pollen_aggregates.tier_summary(selected_day), hide_index=True)
+
 # Show aqi
 st.markdown('#### 城市空气质量指数')
-st.pyplot(make_full_aqi_charts())
+with span('section:aqi'):
+    st.image(figure_cache.render(('aqi', panel_version('aqi')), make_full_aqi_charts, load_aqi_panel()))
 
 # show weather
 st.markdown('#### 城市天气预报')
-st.pyplot(make_full_weather_charts()) 
\ No newline at end of file
+with span('section:weather'):
+    st.image(figure_cache.render(('weather', panel_version('weather')), make_full_weather_charts, load_weather_panel()))
+
+tracer.record('rerun', rerun_start, time.perf_counter() - rerun_t0, rss=process_memory()[0])
@@ -0,0 +1,72 @@
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from pollen_aggregates import build_aggregates, save_aggregates, update_aggregates
+from pollen_store import PollenStore
+
+CITIES = ['Beijing Municipality', 'Chengde', 'Shenyang']
+
+
+def make_store(snapshot_dir):
+    rng = np.random.default_rng(0)
+    days = pd.date_range('2024-05-01', '2024-06-02')
+    frame = pd.DataFrame({'Date': np.repeat(days, len(CITIES)),
+                          'City': CITIES * len(days),
+                          'num': rng.integers(0, 1500, len(days) * len(CITIES)).astype(np.float32)})
+    # A missing day inside the range and a few missing readings
+    frame = frame[frame['Date'] != '2024-05-10']
+    frame.loc[frame.sample(10, random_state=0).index, 'num'] = np.nan
+    store = PollenStore.from_frame(frame)
+    store.version, store.snapshot_dir = (1, 1), snapshot_dir
+    save_aggregates(build_aggregates(store), store)
+    return store
+
+
+class UpdateAggregatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = make_store(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def ingest(self, dates, cities, values):
+        store = self.store
+        changed = store.upsert(pd.to_datetime(dates), cities, values)
+        self.assertTrue(changed.all())
+        days = sorted({day.date() for day in pd.to_datetime(dates)})
+        previous_version, store.version = store.version, (2, 2)
+        updated = update_aggregates(store, days, previous_version)
+        expected = build_aggregates(store)
+
+        self.assertEqual(updated.first_day, expected.first_day)
+        self.assertTrue(updated.cities.equals(expected.cities))
+        np.testing.assert_array_equal(updated.top_codes, expected.top_codes)
+        np.testing.assert_array_equal(updated.top_values, expected.top_values)
+        np.testing.assert_array_equal(updated.tiers, expected.tiers)
+        self.assertEqual(set(updated.rolling), set(expected.rolling))
+        for window, mean in expected.rolling.items():
+            np.testing.assert_allclose(updated.rolling[window], mean, rtol=1e-5)
+
+    def test_append_next_day(self):
+        self.ingest(['2024-06-03'] * 2, CITIES[:2], [100, 900])
+
+    def test_append_after_gap(self):
+        self.ingest(['2024-06-06'] * 3, CITIES, [100, 900, 20])
+
+    def test_backfill_missing_day(self):
+        self.ingest(['2024-05-10'] * 3, CITIES, [300, 50, 1200])
+
+    def test_backfill_before_first_day(self):
+        self.ingest(['2024-04-28'], CITIES[:1], [60])
+
+    def test_new_city(self):
+        self.ingest(['2024-06-02', '2024-06-03'], ['Eerduosi', 'Eerduosi'], [155, 170])
+
+
+if __name__ == '__main__':
+    unittest.main()